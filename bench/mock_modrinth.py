@@ -0,0 +1,314 @@
+import argparse, asyncio, hashlib, json, random, time, threading
+from collections import Counter, deque
+from aiohttp import web
+
+# a local stand-in for api.modrinth.com and its CDN, serving a synthetic catalogue.
+# only the endpoints emthree uses are implemented, with the same shapes as the real API
+
+GAME_VERSIONS = ['1.20.1', '1.20.4', '1.21', '1.21.4', '1.21.11']
+CATEGORIES = ['optimization', 'utility', 'decoration', 'storage', 'worldgen', 'library']
+BLOCK = 64 * 1024
+
+class Catalogue():
+    # projects mod-0 .. mod-{n-1}, each depending on a few projects with a higher index, so the
+    # dependency graph is acyclic and most of it is reached from the first few projects.
+    # every tenth project has no version for the newest game version, and every fifth has a newer beta
+    def __init__(self, projects: int = 200, versions: int = 8, deps: int = 2, file_size: int = 256 * 1024, seed: int = 1):
+        rng = random.Random(seed)
+        self.file_size = file_size
+        self.base_url = None # set once the server knows its port
+        self.projects: dict[str, dict] = {}
+        self.slugs: dict[str, str] = {}
+        self.versions: dict[str, dict] = {}
+        self.by_project: dict[str, list[dict]] = {}
+        self.by_hash: dict[str, dict] = {}
+        self._hashes: dict[str, tuple[str, str]] = {}
+        for i in range(projects):
+            pid = f'P{i:07d}'
+            slug = f'mod-{i}'
+            later = list(range(i + 1, projects))
+            requires = [f'P{j:07d}' for j in rng.sample(later, min(deps, len(later)))]
+            category = CATEGORIES[i % len(CATEGORIES)]
+            self.projects[pid] = {
+                'id': pid, 'slug': slug, 'title': f'Mod {i}', 'project_type': 'mod', 'versions': [],
+                'description': f'A {category} mod, number {i} of the catalogue', 'categories': [category],
+                'loaders': ['fabric'], 'game_versions': [], 'downloads': rng.randrange(1000000),
+            }
+            self.slugs[slug] = pid
+            history = []
+            for n in range(versions):
+                gv = GAME_VERSIONS[min(len(GAME_VERSIONS) - 1, n * len(GAME_VERSIONS) // versions)]
+                if i % 10 == 9 and gv == GAME_VERSIONS[-1]: gv = GAME_VERSIONS[-2]
+                vid = f'V{i:05d}{n:03d}'
+                history.append({
+                    'id': vid,
+                    'project_id': pid,
+                    'name': f'{slug} {n}.0.0',
+                    'version_number': f'{n}.0.0',
+                    'version_type': 'beta' if i % 5 == 4 and n == versions - 1 else 'release',
+                    'date_published': f'2024-01-01T00:00:{n:02d}Z',
+                    'game_versions': [gv],
+                    'loaders': ['fabric'],
+                    'dependencies': [{'version_id': None, 'project_id': d, 'file_name': None, 'dependency_type': 'required'} for d in requires],
+                    'files': [{'filename': f'{slug}-{n}.0.0.jar', 'primary': True, 'size': file_size}],
+                })
+            for v in history:
+                self.versions[v['id']] = v
+                self.projects[pid]['versions'].append(v['id'])
+                if v['game_versions'][0] not in self.projects[pid]['game_versions']: self.projects[pid]['game_versions'] += v['game_versions']
+            self.by_project[pid] = history
+
+    def content(self, vid: str, start: int = 0, end: int = None) -> bytes:
+        # the file is one block derived from the version id, repeated. any range can be produced without storing it
+        end = self.file_size if end is None else end
+        block = (hashlib.sha512(vid.encode()).digest() * (BLOCK // 64))
+        first, last = start // BLOCK, (end - 1) // BLOCK
+        return (block * (last - first + 1))[start - first * BLOCK:end - first * BLOCK]
+
+    def hashes(self, vid: str) -> tuple[str, str]:
+        if vid not in self._hashes:
+            sha1, sha512 = hashlib.sha1(), hashlib.sha512()
+            for i in range(0, self.file_size, 4 * BLOCK):
+                chunk = self.content(vid, i, min(self.file_size, i + 4 * BLOCK))
+                sha1.update(chunk)
+                sha512.update(chunk)
+            self._hashes[vid] = (sha1.hexdigest(), sha512.hexdigest())
+            self.by_hash[sha1.hexdigest()] = self.by_hash[sha512.hexdigest()] = self.versions[vid]
+        return self._hashes[vid]
+
+    def version(self, vid: str) -> dict:
+        v = dict(self.versions[vid])
+        sha1, sha512 = self.hashes(vid)
+        v['files'] = [dict(f, url=f'{self.base_url}cdn/data/{vid}/{f["filename"]}', hashes={'sha1': sha1, 'sha512': sha512}) for f in v['files']]
+        return v
+
+    def project(self, key: str) -> dict:
+        return self.projects.get(key) or self.projects.get(self.slugs.get(key.lower()))
+
+    def search(self, offset: int = 0, limit: int = 10) -> dict:
+        # search hits name their fields differently from project documents, and list loaders as categories
+        ranked = sorted(self.projects.values(), key=lambda p: p['downloads'], reverse=True)
+        hits = [{'project_id': p['id'], 'slug': p['slug'], 'title': p['title'], 'description': p['description'], 'project_type': 'mod',
+                 'categories': p['categories'] + p['loaders'], 'versions': p['game_versions'], 'downloads': p['downloads']}
+                for p in ranked[offset:offset + limit]]
+        return {'hits': hits, 'offset': offset, 'limit': limit, 'total_hits': len(ranked)}
+
+    def project_versions(self, key: str, loaders: list[str] = None, game_versions: list[str] = None) -> list[dict]:
+        project = self.project(key)
+        if project is None: return None
+        return [self.version(v['id']) for v in self.by_project[project['id']]
+                if (not loaders or set(loaders) & set(v['loaders'])) and (not game_versions or set(game_versions) & set(v['game_versions']))]
+
+class MockServer():
+    # latency is in seconds per request. rate_limit requests per minute are allowed per host, like the real
+    # API, and fail_rate is the chance of a spurious 429 on any request. error_rate is the chance of a 503,
+    # and slow_rate the chance of a request taking slow_latency seconds longer, which makes up the tail
+    def __init__(self, catalogue: Catalogue, latency: float = 0.0, cdn_latency: float = 0.0, rate_limit: int = 300, fail_rate: float = 0.0, seed: int = 1,
+                 error_rate: float = 0.0, slow_rate: float = 0.0, slow_latency: float = 1.0):
+        self.catalogue = catalogue
+        self.latency = latency
+        self.cdn_latency = cdn_latency
+        self.rate_limit = rate_limit
+        self.fail_rate = fail_rate
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self._rng = random.Random(seed)
+        self._windows = {'api': deque(), 'cdn': deque()}
+        self.requests = Counter()
+        self.bytes_sent = 0
+        self.throttled = 0
+        self.errors = 0
+        self.url = None
+        self._runner = None
+
+    def reset_stats(self):
+        self.requests.clear()
+        self.bytes_sent = 0
+        self.throttled = 0
+        self.errors = 0
+
+    def stats(self) -> dict:
+        return {'requests': dict(self.requests), 'bytes_sent': self.bytes_sent, 'throttled': self.throttled, 'errors': self.errors}
+
+    def _limit(self, host: str) -> tuple[dict, bool]:
+        # sliding one minute window. returns the rate limit headers, and whether the request is allowed
+        now = time.monotonic()
+        window = self._windows[host]
+        while window and now - window[0] >= 60: window.popleft()
+        allowed = len(window) < self.rate_limit and self._rng.random() >= self.fail_rate
+        if allowed: window.append(now)
+        reset = 60 - (now - window[0]) if window else 60
+        headers = {
+            'X-Ratelimit-Limit': str(self.rate_limit),
+            'X-Ratelimit-Remaining': str(max(0, self.rate_limit - len(window))),
+            'X-Ratelimit-Reset': str(max(1, round(reset))),
+        }
+        if not allowed and len(window) < self.rate_limit:
+            # a spurious 429 only needs a short wait
+            headers['Retry-After'] = '1'
+        return headers, allowed
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        host = 'cdn' if request.path.startswith('/cdn/') else 'api'
+        delay = self.cdn_latency if host == 'cdn' else self.latency
+        if self._rng.random() < self.slow_rate: delay += self.slow_latency
+        await asyncio.sleep(delay)
+        headers, allowed = self._limit(host)
+        endpoint = request.match_info.route.name or request.path
+        self.requests[endpoint] += 1
+        if not allowed:
+            self.throttled += 1
+            return web.json_response({'error': 'ratelimited'}, status=429, headers=headers)
+        if self._rng.random() < self.error_rate:
+            self.errors += 1
+            return web.json_response({'error': 'unavailable'}, status=503, headers=headers)
+        # streamed responses send their headers before the middleware gets them back
+        request['ratelimit'] = headers
+        response = await handler(request)
+        if isinstance(response, web.Response):
+            response.headers.update(headers)
+            if isinstance(response.body, (bytes, bytearray)): self.bytes_sent += len(response.body)
+        return response
+
+    def _json(self, data, status: int = 200):
+        return web.Response(body=json.dumps(data).encode(), status=status, content_type='application/json')
+
+    @staticmethod
+    def _ids(request) -> list[str]:
+        return json.loads(request.query.get('ids', '[]'))
+
+    async def get_project(self, request):
+        project = self.catalogue.project(request.match_info['id'])
+        return self._json(project) if project else self._json({'error': 'not_found'}, 404)
+
+    async def get_projects(self, request):
+        found = [self.catalogue.project(i) for i in self._ids(request)]
+        return self._json([p for p in found if p])
+
+    async def get_search(self, request):
+        return self._json(self.catalogue.search(int(request.query.get('offset', 0)), min(100, int(request.query.get('limit', 10)))))
+
+    async def get_project_versions(self, request):
+        loaders = json.loads(request.query['loaders']) if 'loaders' in request.query else None
+        game_versions = json.loads(request.query['game_versions']) if 'game_versions' in request.query else None
+        versions = self.catalogue.project_versions(request.match_info['id'], loaders, game_versions)
+        return self._json(versions) if versions is not None else self._json({'error': 'not_found'}, 404)
+
+    async def get_version(self, request):
+        vid = request.match_info['id']
+        if vid not in self.catalogue.versions: return self._json({'error': 'not_found'}, 404)
+        return self._json(self.catalogue.version(vid))
+
+    async def get_versions(self, request):
+        return self._json([self.catalogue.version(v) for v in self._ids(request) if v in self.catalogue.versions])
+
+    async def post_version_files(self, request):
+        payload = await request.json()
+        for vid in self.catalogue.versions: self.catalogue.hashes(vid)
+        found = {h: self.catalogue.by_hash[h] for h in payload['hashes'] if h in self.catalogue.by_hash}
+        return self._json({h: self.catalogue.version(v['id']) for h, v in found.items()})
+
+    async def post_version_files_update(self, request):
+        payload = await request.json()
+        for vid in self.catalogue.versions: self.catalogue.hashes(vid)
+        result = {}
+        for h in payload['hashes']:
+            if h not in self.catalogue.by_hash: continue
+            candidates = self.catalogue.project_versions(self.catalogue.by_hash[h]['project_id'], payload.get('loaders'), payload.get('game_versions'))
+            if candidates: result[h] = max(candidates, key=lambda v: v['date_published'])
+        return self._json(result)
+
+    async def get_file(self, request):
+        vid = request.match_info['id']
+        if vid not in self.catalogue.versions: return web.Response(status=404)
+        size = self.catalogue.file_size
+        start = 0
+        status = 200
+        if request.http_range.start is not None:
+            start = request.http_range.start
+            if start >= size: return web.Response(status=416)
+            status = 206
+        response = web.StreamResponse(status=status, headers={'Content-Length': str(size - start), **request['ratelimit']})
+        if status == 206: response.headers['Content-Range'] = f'bytes {start}-{size - 1}/{size}'
+        await response.prepare(request)
+        for i in range(start, size, BLOCK):
+            chunk = self.catalogue.content(vid, i, min(size, i + BLOCK))
+            self.bytes_sent += len(chunk)
+            await response.write(chunk)
+        await response.write_eof()
+        return response
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self.middleware])
+        app.router.add_get('/v2/project/{id}', self.get_project, name='project')
+        app.router.add_get('/v2/projects', self.get_projects, name='projects')
+        app.router.add_get('/v2/search', self.get_search, name='search')
+        app.router.add_get('/v2/project/{id}/version', self.get_project_versions, name='project.version')
+        app.router.add_get('/v2/version/{id}', self.get_version, name='version')
+        app.router.add_get('/v2/versions', self.get_versions, name='versions')
+        app.router.add_post('/v2/version_files', self.post_version_files, name='version_files')
+        app.router.add_post('/v2/version_files/update', self.post_version_files_update, name='version_files.update')
+        app.router.add_get('/cdn/data/{id}/{filename}', self.get_file, name='cdn')
+        return app
+
+    async def start(self, port: int = 0) -> str:
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://127.0.0.1:{port}/'
+        self.catalogue.base_url = self.url
+        return self.url + 'v2/'
+
+    async def stop(self):
+        if self._runner: await self._runner.cleanup()
+
+    def start_in_thread(self, port: int = 0) -> str:
+        # runs the server on its own event loop, so the caller is free to block on subprocesses
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+        result = {}
+        def run():
+            asyncio.set_event_loop(loop)
+            try:
+                result['root'] = loop.run_until_complete(self.start(port))
+            except Exception as e:
+                result['error'] = e
+                return
+            finally:
+                started.set()
+            loop.run_forever()
+        threading.Thread(target=run, daemon=True).start()
+        started.wait()
+        if 'error' in result: raise result['error']
+        return result['root']
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a synthetic Modrinth API and CDN locally')
+    parser.add_argument('--port', type=int, default=8787)
+    parser.add_argument('--projects', type=int, default=200)
+    parser.add_argument('--versions', type=int, default=8)
+    parser.add_argument('--deps', type=int, default=2)
+    parser.add_argument('--file-size', type=int, default=256, help='KiB per jar')
+    parser.add_argument('--latency', type=float, default=0.0, help='ms per API request')
+    parser.add_argument('--cdn-latency', type=float, default=0.0, help='ms per CDN request')
+    parser.add_argument('--rate-limit', type=int, default=300, help='requests per minute')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='chance of a spurious 429')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='chance of a 503')
+    parser.add_argument('--slow-rate', type=float, default=0.0, help='chance of a request taking --slow-latency longer')
+    parser.add_argument('--slow-latency', type=float, default=1000.0, help='ms added to slow requests')
+    args = parser.parse_args()
+    catalogue = Catalogue(args.projects, args.versions, args.deps, args.file_size * 1024)
+    server = MockServer(catalogue, args.latency / 1000, args.cdn_latency / 1000, args.rate_limit, args.fail_rate,
+                        error_rate=args.error_rate, slow_rate=args.slow_rate, slow_latency=args.slow_latency / 1000)
+    async def serve():
+        root = await server.start(args.port)
+        print(f'Serving {args.projects} projects at {root}')
+        await asyncio.Event().wait()
+    asyncio.run(serve())
+
+if __name__ == '__main__':
+    main()
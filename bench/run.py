@@ -0,0 +1,107 @@
+import argparse, json, os, shutil, subprocess, sys, tempfile, time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+from mock_modrinth import Catalogue, MockServer, GAME_VERSIONS
+
+# drives the emthree CLI end to end against the local mock server and reports, per scenario, the requests
+# made, wall time, peak RSS of the emthree process and bytes transferred. every run starts from an empty
+# data dir, so the numbers are comparable between commits
+
+REPO = Path(__file__).resolve().parent.parent
+
+SCENARIOS = {
+    # name: (description, emthree arguments)
+    'init-cold': ('resolve and download the user list with empty caches', ['init', '-u', '{userlist}']),
+    'init-locked': ('install from the written lockfile, everything cached', ['init']),
+    'add': ('add a mod with its dependencies', ['add', '{addon}']),
+    'download': ('install from the lockfile into an empty mods folder and store', ['init']),
+    'update': ('check every installed jar for updates', ['update']),
+}
+
+def run_emthree(env: dict, config: Path, arguments: list[str]) -> tuple[int, float, int, str]:
+    # returns exit code, wall time, peak RSS in KiB and the last lines of output
+    command = [sys.executable, '-m', 'emthree', '--config', str(config)] + arguments + ['-y', '--prefer', 'release', '--legacy', 'allow']
+    start = time.perf_counter()
+    with tempfile.TemporaryFile() as out:
+        process = subprocess.Popen(command, cwd=REPO, env=env, stdout=out, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL)
+        # wait4 reports the resource usage of this process alone
+        _, status, usage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        out.seek(0)
+        tail = out.read().decode(errors='replace').strip().splitlines()[-3:]
+    return process.returncode, elapsed, usage.ru_maxrss, '\n'.join(tail)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark emthree against a local mock of Modrinth')
+    parser.add_argument('--projects', type=int, default=200, help='projects in the synthetic catalogue')
+    parser.add_argument('--versions', type=int, default=8, help='versions per project')
+    parser.add_argument('--deps', type=int, default=2, help='required dependencies per project')
+    parser.add_argument('--roots', type=int, default=20, help='mods in the user list')
+    parser.add_argument('--file-size', type=int, default=256, help='KiB per jar')
+    parser.add_argument('--latency', type=float, default=20.0, help='ms per API request')
+    parser.add_argument('--cdn-latency', type=float, default=20.0, help='ms per CDN request')
+    parser.add_argument('--rate-limit', type=int, default=300, help='requests per minute')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='chance of a spurious 429')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='chance of a 503')
+    parser.add_argument('--slow-rate', type=float, default=0.0, help='chance of a request taking --slow-latency longer')
+    parser.add_argument('--slow-latency', type=float, default=1000.0, help='ms added to slow requests')
+    parser.add_argument('--hedge-after', type=float, help='ms before emthree sends a slow API request again')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--keep', action='store_true', help="don't delete the working directory")
+    args = parser.parse_args()
+
+    catalogue = Catalogue(args.projects, args.versions, args.deps, args.file_size * 1024)
+    server = MockServer(catalogue, args.latency / 1000, args.cdn_latency / 1000, args.rate_limit, args.fail_rate,
+                        error_rate=args.error_rate, slow_rate=args.slow_rate, slow_latency=args.slow_latency / 1000)
+    root = server.start_in_thread()
+
+    work = Path(tempfile.mkdtemp(prefix='emthree-bench-'))
+    mod_path = work / 'mods'
+    list_path = work / 'lists'
+    data = work / 'data'
+    mod_path.mkdir()
+    userlist = work / 'userlist.txt'
+    userlist.write_text('\n'.join(f'mod-{i}' for i in range(args.roots)) + '\n')
+    config = work / 'config.json'
+    config.write_text(json.dumps({
+        'game': {'game_version': GAME_VERSIONS[-1], 'mod_path': str(mod_path)},
+        'emthree': {'list_path': str(list_path), 'api_root': root, 'hedge_after_ms': args.hedge_after},
+    }, indent=4))
+    # the cache, hash index and jar store all live under the data dir
+    env = dict(os.environ, XDG_DATA_HOME=str(data), XDG_CONFIG_HOME=str(work / 'config'), PYTHONPATH=str(REPO))
+    # add a project that nothing in the user list pulls in
+    required = {d['project_id'] for v in catalogue.versions.values() for d in v['dependencies']}
+    addon = next((p['slug'] for p in list(catalogue.projects.values())[args.roots:] if p['id'] not in required), f'mod-{args.projects - 1}')
+    placeholders = {'userlist': str(userlist), 'addon': addon}
+
+    print(f'{args.projects} projects, {args.versions} versions each, {args.roots} in the user list, '
+          f'{args.file_size} KiB jars, {args.latency} ms API latency, {args.rate_limit} requests/min\n')
+    print(f'{"scenario":<12} {"exit":>4} {"api":>6} {"cdn":>6} {"429":>5} {"5xx":>5} {"wall s":>8} {"rss MiB":>8} {"MiB sent":>9}')
+    results = []
+    for name in args.scenarios:
+        if name == 'download':
+            shutil.rmtree(mod_path)
+            mod_path.mkdir()
+            shutil.rmtree(data / 'emthree' / 'store', ignore_errors=True)
+        server.reset_stats()
+        arguments = [a.format(**placeholders) for a in SCENARIOS[name][1]]
+        code, elapsed, rss, tail = run_emthree(env, config, arguments)
+        stats = server.stats()
+        cdn = stats['requests'].get('cdn', 0)
+        api = sum(stats['requests'].values()) - cdn
+        results.append({'scenario': name, 'exit': code, 'api_requests': api, 'cdn_requests': cdn, 'throttled': stats['throttled'], 'errors': stats['errors'],
+                        'wall_time': round(elapsed, 3), 'peak_rss_kib': rss, 'bytes_sent': stats['bytes_sent'], 'endpoints': stats['requests']})
+        print(f'{name:<12} {code:>4} {api:>6} {cdn:>6} {stats["throttled"]:>5} {stats["errors"]:>5} {elapsed:>8.2f} {rss / 1024:>8.1f} {stats["bytes_sent"] / 1024 / 1024:>9.2f}')
+        if code != 0: print(tail)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'parameters': vars(args), 'results': results}, f, indent=4)
+    if args.keep: print(f'\nWorking directory: {work}')
+    else: shutil.rmtree(work, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+import argparse, json, os, shutil, statistics, subprocess, sys, tempfile, time
+from pathlib import Path
+
+# measures how long the emthree CLI takes to start for commands that never touch the network, using
+# python -X importtime. scripts call emthree many times in a row, so every millisecond here adds up.
+# with --check it fails if any of these commands imports the network stack
+
+REPO = Path(__file__).resolve().parent.parent
+
+COMMANDS = {
+    # name: emthree arguments
+    'help': ['--help'],
+    'list': ['list'],
+    'check': ['check'],
+    'export': ['export', '{pack}'],
+    'search': ['search', '--no-cache', 'sodium'],
+}
+# modules offline commands must not import
+NETWORK = ('aiohttp', 'emthree.api')
+
+def parse_importtime(stderr: str) -> list[tuple[str, int, int]]:
+    # (module, nesting depth, cumulative microseconds) for every import, from -X importtime's output
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line: continue
+        _, cumulative, name = line.removeprefix('import time:').split('|')
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        imports.append((name.strip(), depth, int(cumulative)))
+    return imports
+
+def run_command(env: dict, config: Path, arguments: list[str]) -> tuple[int, float, list[tuple[str, int, int]]]:
+    # returns exit code, wall time and the imports the command made
+    command = [sys.executable, '-X', 'importtime', '-m', 'emthree', '--config', str(config)] + arguments
+    start = time.perf_counter()
+    process = subprocess.run(command, cwd=REPO, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL, text=True)
+    elapsed = time.perf_counter() - start
+    return process.returncode, elapsed, parse_importtime(process.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the startup time of offline emthree commands')
+    parser.add_argument('--runs', type=int, default=5, help='runs per command, the median is reported')
+    parser.add_argument('--commands', nargs='+', choices=COMMANDS, default=list(COMMANDS))
+    parser.add_argument('--top', type=int, default=0, help='also show the slowest top level imports of each command')
+    parser.add_argument('--check', action='store_true', help='exit with an error if a command imports the network stack')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    work = Path(tempfile.mkdtemp(prefix='emthree-startup-'))
+    mod_path = work / 'mods'
+    list_path = work / 'lists'
+    mod_path.mkdir()
+    list_path.mkdir()
+    (list_path / 'modlist.json').write_text('[]')
+    config = work / 'config.json'
+    config.write_text(json.dumps({
+        'game': {'game_version': '1.21.11', 'mod_path': str(mod_path)},
+        'emthree': {'list_path': str(list_path)},
+    }, indent=4))
+    env = dict(os.environ, XDG_DATA_HOME=str(work / 'data'), XDG_CONFIG_HOME=str(work / 'config'), PYTHONPATH=str(REPO))
+    placeholders = {'pack': str(work / 'pack.mrpack')}
+
+    print(f'{"command":<10} {"exit":>4} {"wall ms":>8} {"import ms":>10} {"modules":>8}  network')
+    results = []
+    failed = False
+    for name in args.commands:
+        arguments = [a.format(**placeholders) for a in COMMANDS[name]]
+        runs = [run_command(env, config, arguments) for _ in range(args.runs)]
+        code = max(r[0] for r in runs)
+        wall = statistics.median(r[1] for r in runs)
+        imports = runs[-1][2]
+        import_time = statistics.median(sum(c for _, depth, c in r[2] if depth == 0) for r in runs) / 1000
+        network = sorted({n for m, _, _ in imports for n in NETWORK if m == n or m.startswith(n + '.')})
+        if network or code != 0: failed = True
+        results.append({'command': name, 'exit': code, 'wall_ms': round(wall * 1000, 1), 'import_ms': round(import_time, 1),
+                        'modules': len(imports), 'network_modules': network})
+        print(f'{name:<10} {code:>4} {wall * 1000:>8.1f} {import_time:>10.1f} {len(imports):>8}  {", ".join(network) or "-"}')
+        if args.top:
+            for module, _, cumulative in sorted((i for i in imports if i[1] == 0), key=lambda i: i[2], reverse=True)[:args.top]:
+                print(f'    {module:<30} {cumulative / 1000:>8.1f} ms')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'parameters': vars(args), 'python': sys.version, 'results': results}, f, indent=4)
+    shutil.rmtree(work, ignore_errors=True)
+    if args.check and failed: sys.exit(1)
+
+if __name__ == '__main__':
+    main()
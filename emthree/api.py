@@ -1,80 +1,432 @@
-import time, logging, aiohttp
+import asyncio, hashlib, json, os, random, time, logging, aiohttp
 from pathlib import Path
-from datetime import datetime
+from urllib.parse import quote, urlsplit
+from emthree.ratelimit import RateLimiter
+from emthree.cache import ResponseCache, OfflineCacheMiss
+from emthree.hashing import pick_hash, hash_file, hash_into
+from emthree.store import JarStore
+from emthree.trace import Tracer, endpoint_of
+from emthree.versions import Version, ModFile
 
 logger = logging.getLogger(__name__)
 
+# the fields of a project document kept in memory
+PROJECT_FIELDS = ('id', 'slug', 'title', 'project_type')
+# failures that say nothing about the request itself, so sending it again can succeed
+RETRY_STATUSES = (500, 502, 503, 504)
+RETRY_ERRORS = (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError)
+
+class HashMismatchError(Exception):
+    pass
+
+class _Retry(Exception):
+    # raised by an attempt that should be made again after delay seconds, see ModrinthAPI._retrying
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+
+class BatchLoader():
+    # dataloader style batching: keys requested by concurrent callers within the same short window
+    # are fetched together in chunked bulk requests, and each caller gets back its own result
+    def __init__(self, fetch, key_fields: tuple[str], chunk_size: int = 100, delay: float = 0.01):
+        self._fetch = fetch
+        self._key_fields = key_fields
+        self.chunk_size = chunk_size
+        self.delay = delay
+        self._futures: dict[str, asyncio.Future] = {}
+        self._queue: list[str] = []
+        self._handle = None
+
+    def load(self, key: str) -> asyncio.Future:
+        if key in self._futures:
+            return self._futures[key]
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._futures[key] = fut
+        self._queue.append(key)
+        if self._handle is None:
+            self._handle = loop.call_later(self.delay, self._dispatch)
+        return fut
+
+    def _dispatch(self):
+        queue, self._queue, self._handle = self._queue, [], None
+        for i in range(0, len(queue), self.chunk_size):
+            asyncio.ensure_future(self._run(queue[i:i + self.chunk_size]))
+
+    async def _run(self, keys: list[str]):
+        try:
+            results = await self._fetch(keys)
+        except Exception as e:
+            for k in keys:
+                fut = self._futures.pop(k)
+                if not fut.done(): fut.set_exception(e)
+            return
+        # ids are case sensitive, but slugs aren't
+        found = {}
+        folded = {}
+        for r in results:
+            for field in self._key_fields:
+                if r.get(field): found[r[field]] = r
+            if r.get('slug'): folded[r['slug'].lower()] = r
+        for k in keys:
+            fut = self._futures[k]
+            if not fut.done(): fut.set_result(found.get(k) or folded.get(k.lower()))
+
+class VersionStore():
+    # every version seen during a session, keyed by version id. version lists already contain
+    # everything needed for dependencies, file selection and serialisation, so they are never fetched twice
+    def __init__(self):
+        self._versions: dict[str, Version] = {}
+
+    def __contains__(self, version_id: str) -> bool:
+        return version_id in self._versions
+
+    def __len__(self) -> int:
+        return len(self._versions)
+
+    def add(self, version) -> Version:
+        # API objects are trimmed to a Version here, so the full JSON can be freed as soon as it is parsed
+        if not version: return None
+        if isinstance(version, dict): version = Version.from_json(version)
+        self._versions[version.id] = version
+        return version
+
+    def get(self, version_id: str) -> Version:
+        return self._versions.get(version_id)
+
+    def dependencies(self, version_id: str) -> list[dict]:
+        return [{"project_id": p, "version_id": v} for p, v in self._versions[version_id].dependencies]
+
 class ModrinthAPI():
-    def __init__(self, session):
+    def __init__(self, session, cache: ResponseCache = None, offline: bool = False, api_concurrency: int = 16, store: JarStore = None, root: str = None, tracer: Tracer = None,
+                 max_retries: int = 5, retry_backoff: float = 0.5, hedge_after: float = None, chunk_size: int = 256 * 1024):
         self.session = session
-        self.root = "https://api.modrinth.com/v2/"
-        self.reqcount = 0
+        self.root = root or "https://api.modrinth.com/v2/"
+        self.cache = cache
+        # jars are installed from, and added to, the shared store when one is given
+        self.store = store
+        # records every request when tracing is enabled, see Tracer
+        self.tracer = tracer
+        # serve everything from the cache and never touch the network
+        self.offline = offline
         self.reqcount_total = 0
-        self.maxcalls = 300
-        self.last_req = time.time()
+        self.max_retries = max_retries
+        # retries wait a random time of up to retry_backoff * 2^attempt seconds, so requests that failed together
+        # don't all come back at the same moment
+        self.retry_backoff = retry_backoff
+        self.max_backoff = 10.0
+        # API GETs still unanswered after hedge_after seconds are sent again, and whichever answer comes first is used
+        self.hedge_after = hedge_after
+        self.chunk_size = chunk_size # bytes read from the network per write when downloading
         self.init_req = time.time()
+        # API calls and CDN downloads are budgeted separately
+        self.api_limiter = RateLimiter('api', 300)
+        self.cdn_limiter = RateLimiter('cdn', 300)
+        # requests in flight against the API host. downloads are bounded by the DownloadScheduler
+        self.api_slots = asyncio.Semaphore(api_concurrency)
+        # project and version lookups from concurrent mods are batched into bulk requests
+        self.projects = BatchLoader(self._fetch_projects, ('id', 'slug'))
+        self._version_loader = BatchLoader(self._fetch_versions_bulk, ('id',))
+        self.versions = VersionStore()
+        self._version_lists: dict[str, asyncio.Future] = {}
 
-    def ratelimit(self):
-        self.reqcount += 1
+    async def ratelimit(self, limiter: RateLimiter):
         self.reqcount_total += 1
         if self.reqcount_total == 1: self.init_req = time.time()
-        if self.reqcount == 1:
-            self.last_req = time.time()
-            return
-        else: elapsed = time.time() - self.last_req
-        if elapsed < 60.0 and self.reqcount == self.maxcalls:
-            logger.info("Rate limited... pausing")
-            self.reqcount = 0
-            time.sleep(60.0 - elapsed)
-            logger.info("resumed")
-            self.last_req = time.time()
-        elif elapsed >= 60.0:
-            self.reqcount = 0
-
-    async def get_async(self, url: str):
-        self.ratelimit()
-        async with self.session.get(self.root + url) as response:
-            return await response.json()
-
-    async def download(self, file_to_get, install_dir: Path):
+        return await limiter.acquire()
+
+    def _trace(self, kind: str, url: str, status: int = None, latency: float = 0.0, size: int = 0, cache: str = None, wait: float = 0.0, disk: float = 0.0, method: str = 'GET'):
+        if self.tracer: self.tracer.record(kind, endpoint_of(url, self.root), status, latency, size, cache, wait, disk, method)
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_backoff, self.retry_backoff * 2 ** attempt))
+
+    def _check_retry(self, response, attempt: int, limiter: RateLimiter):
+        # asks for another attempt if the response says nothing about the request itself. on the last attempt
+        # the response is left for the caller to raise
+        if attempt == self.max_retries: return
+        if response.status == 429:
+            limiter.backoff(response.headers)
+            raise _Retry()
+        if response.status in RETRY_STATUSES: raise _Retry(self._backoff(attempt))
+
+    async def _retrying(self, what: str, attempt):
+        # calls attempt(n) until it returns. attempts raise _Retry to go again, and connections that drop are
+        # retried with backoff until the last attempt, which raises whatever went wrong
+        for n in range(self.max_retries + 1):
+            try:
+                return await attempt(n)
+            except _Retry as r:
+                delay = r.delay
+            except RETRY_ERRORS as err:
+                if n == self.max_retries: raise err
+                delay = self._backoff(n)
+                logger.warning(f'{what} failed ({err.__class__.__name__}). Retrying in {round(delay, 1)} secs...')
+            if delay: await asyncio.sleep(delay)
+        raise aiohttp.ClientError(f'{what} failed {self.max_retries + 1} times')
+
+    async def _slot(self, limiter: RateLimiter) -> float:
+        # waits for the rate limiter and then for a free API slot. returns the time spent waiting on both
+        queued = time.perf_counter()
+        await self.ratelimit(limiter)
+        await self.api_slots.acquire()
+        return time.perf_counter() - queued
+
+    async def get_async(self, url: str, use_cache: bool = True):
+        entry = self.cache.get(url) if self.cache and use_cache else None
+        if entry and (entry.fresh or self.offline):
+            self._trace('api', url, cache='hit')
+            return entry.json()
+        if self.offline:
+            logger.warning(f'{url} is not cached, and emthree is running offline.')
+            raise OfflineCacheMiss(url)
+        headers = {}
+        if entry and entry.etag: headers['If-None-Match'] = entry.etag
+        if entry and entry.last_modified: headers['If-Modified-Since'] = entry.last_modified
+
+        async def attempt(n: int):
+            response, body, latency, wait = await self._hedged(url, headers)
+            if response.status == 304 and entry:
+                self.cache.touch(url)
+                self._trace('api', url, 304, latency, cache='revalidated', wait=wait)
+                return entry.json()
+            if response.status >= 400:
+                self._trace('api', url, response.status, latency, wait=wait)
+                self._check_retry(response, n, self.api_limiter)
+            response.raise_for_status()
+            self._trace('api', url, response.status, latency, len(body), 'miss' if use_cache else 'bypass', wait)
+            if self.cache and use_cache:
+                self.cache.put(url, body, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+            return json.loads(body)
+
+        return await self._retrying(f'Request for {url}', attempt)
+
+    async def _get_once(self, url: str, headers: dict):
+        # returns the response, already read and released, its body, and the time spent on the network and waiting for a slot
+        wait = await self._slot(self.api_limiter)
+        start = time.perf_counter()
         try:
-            file_path = Path(install_dir) / file_to_get['filename']
-            if not file_path.is_file():
-                self.ratelimit()
-                async with self.session.get(file_to_get['url']) as c:
-                    with open(file_path, 'xb') as f:
-                        while True:
-                            chunk = await c.content.read(1024)
-                            if not chunk: break
-                            f.write(chunk)
-                
+            async with self.session.get(self.root + url, headers=headers) as response:
+                self.api_limiter.update(response.headers)
+                body = await response.read()
+                return response, body, time.perf_counter() - start, wait
+        finally:
+            self.api_slots.release()
+
+    async def _hedged(self, url: str, headers: dict):
+        # a slow answer is usually a slow connection or server, not a slow request, so a second copy
+        # sent after hedge_after tends to finish well before the first one. the loser is cancelled
+        if not self.hedge_after: return await self._get_once(url, headers)
+        pending = {asyncio.ensure_future(self._get_once(url, headers))}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=self.hedge_after)
+            if not done:
+                if self.tracer: self.tracer.count('hedged requests')
+                logger.debug(f'{url} is slow, sending it again')
+                pending.add(asyncio.ensure_future(self._get_once(url, headers)))
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None: return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending: task.cancel()
+
+    async def post_async(self, url: str, payload: dict):
+        # POST endpoints are lookups that change with every payload, so they are never cached
+        if self.offline:
+            logger.warning(f"Can't query {url} while running offline.")
+            raise OfflineCacheMiss(url)
+        # they only look things up, so they are as safe to send again as a GET
+        async def attempt(n: int):
+            wait = await self._slot(self.api_limiter)
+            start = time.perf_counter()
+            try:
+                async with self.session.post(self.root + url, json=payload) as response:
+                    self.api_limiter.update(response.headers)
+                    body = await response.read()
+                    self._trace('api', url, response.status, time.perf_counter() - start, len(body), wait=wait, method='POST')
+                    self._check_retry(response, n, self.api_limiter)
+                    response.raise_for_status()
+                    return json.loads(body)
+            finally:
+                self.api_slots.release()
+
+        return await self._retrying(f'Request for {url}', attempt)
+
+    async def _fetch_bulk(self, endpoint: str, single: str, ids: list[str], trim = None) -> list[dict]:
+        # bulk responses are cached per object, so any combination of ids can be answered from the cache.
+        # trim, if given, drops the fields emthree doesn't use before an object is cached
+        results = []
+        misses = []
+        for i in ids:
+            entry = None
+            if self.cache:
+                entry = self.cache.get(f'{single}/{i}') or self.cache.get(f'{single}/{i.lower()}')
+            if entry and (entry.fresh or self.offline):
+                self._trace('api', f'{single}/{i}', cache='hit')
+                results.append(entry.json())
+            else: misses.append(i)
+        # offline, objects that aren't cached are reported as missing
+        if misses and not self.offline:
+            fetched = await self.get_async(f'{endpoint}?ids={self._encode_ids(misses)}', use_cache=False)
+            if trim: fetched = [trim(r) for r in fetched]
+            if self.cache:
+                for r in fetched:
+                    self.cache.put_json(f'{single}/{r["id"]}', r)
+                    if r.get('slug'): self.cache.put_json(f'{single}/{r["slug"].lower()}', r)
+            results += fetched
+        return results
+
+    async def _fetch_projects(self, ids: list[str]) -> list[dict]:
+        # full project documents are cached, but mods only need to know the project's names
+        projects = await self._fetch_bulk('projects', 'project', ids)
+        return [{k: p.get(k) for k in PROJECT_FIELDS} for p in projects]
+
+    async def _fetch_versions_bulk(self, ids: list[str]) -> list[dict]:
+        return await self._fetch_bulk('versions', 'version', ids, trim=lambda v: Version.from_json(v).to_json())
+
+    @staticmethod
+    def _encode_ids(ids: list[str]) -> str:
+        return quote(json.dumps(ids, separators=(',', ':')))
+
+    async def get_project(self, query: str):
+        # query is either the mod slug or the mod project id. returns None if the project doesn't exist
+        return await self.projects.load(query)
+
+    async def get_version(self, version_id: str) -> Version:
+        if version_id in self.versions:
+            return self.versions.get(version_id)
+        return self.versions.add(await self._version_loader.load(version_id))
+
+    async def search_projects(self, offset: int = 0, limit: int = 100) -> list[dict]:
+        # one page of Modrinth's search, most downloaded mods first. pages change all the time, so they aren't cached
+        facets = self._encode_ids([['project_type:mod']])
+        return (await self.get_async(f'search?limit={limit}&offset={offset}&index=downloads&facets={facets}', use_cache=False))['hits']
+
+    async def download(self, file_to_get: ModFile, install_dir: Path, progress = None):
+        # progress, if given, is called with the number of bytes received after every chunk
+        file_path = Path(install_dir) / file_to_get.filename
+        algorithm, expected = pick_hash(file_to_get)
+        stored = self.store and algorithm == 'sha512'
+        host = urlsplit(file_to_get.url).netloc
+        if stored and await asyncio.to_thread(self.store.verify, expected, file_to_get.size):
+            # no network needed. a blob that was changed through a mods folder is evicted and downloaded again
+            start = time.perf_counter()
+            file_path = await asyncio.to_thread(self.store.install, expected, file_path)
+            self._trace('store', 'install', size=file_to_get.size, cache='hit', disk=time.perf_counter() - start)
+            return file_path
+        if file_path.is_file():
+            start = time.perf_counter()
+            matches = expected is None or await asyncio.to_thread(hash_file, file_path, algorithm) == expected
+            self._trace('disk', 'verify', size=file_path.stat().st_size, disk=time.perf_counter() - start)
+            if matches:
+                logger.info(f"{file_to_get.filename} already exists.")
+                if stored: await self._adopt(file_path, expected)
                 return file_path
-            else: logger.info(f'{file_to_get['filename']} already exists.')
-        except aiohttp.ClientConnectionError as err:
-            raise err
-
-    async def get_slug_from_id(self, mod_id) -> str:
-        self.ratelimit()
-        res = await self.session.get(f'https://modrinth.com/mod/{mod_id}', allow_redirects=False)
-        res.raise_for_status()
-        return res.headers['location'].removeprefix('/mod/')
-
-    async def fetch_versions(self, query):
-        # query is either the mod slug or the mod project id
+            logger.warning(f"{file_to_get.filename} doesn't match its published hash. Downloading it again.")
+        if self.offline:
+            logger.warning(f"Can't download {file_to_get.filename} while running offline.")
+            return
+        # the file is only moved into place once it is complete and verified,
+        # so an interrupted download never leaves a truncated jar behind
+        part_path = file_path.with_name(file_path.name + '.part')
+        async def attempt(n: int):
+            hasher = hashlib.new(algorithm or 'sha1')
+            offset = part_path.stat().st_size if part_path.is_file() else 0
+            # time spent hashing the partial file, and then writing and hashing what is received
+            rehash = 0.0
+            disk = 0.0
+            if offset:
+                start = time.perf_counter()
+                hasher = await asyncio.to_thread(hash_into, hasher, part_path)
+                rehash = time.perf_counter() - start
+            headers = {'Range': f'bytes={offset}-'} if offset else {}
+            received = 0
+            status = None
+            wait = await self.ratelimit(self.cdn_limiter)
+            start = time.perf_counter()
+            try:
+                async with self.session.get(file_to_get.url, headers=headers) as c:
+                    status = c.status
+                    self.cdn_limiter.update(c.headers)
+                    if c.status == 416:
+                        # nothing is left to send after offset, which usually means the partial file is already
+                        # complete, e.g. the last attempt was cut off before the rename. anything else starts over
+                        if offset and (hasher.hexdigest() == expected if expected else offset == file_to_get.size):
+                            os.replace(part_path, file_path)
+                            if stored: await self._adopt(file_path, expected)
+                            return file_path
+                        part_path.unlink()
+                        raise _Retry()
+                    self._check_retry(c, n, self.cdn_limiter)
+                    c.raise_for_status()
+                    if offset and c.status != 206:
+                        # the server ignored the range and is sending the whole file
+                        hasher = hashlib.new(algorithm or 'sha1')
+                        offset = 0
+                    with open(part_path, 'ab' if offset else 'wb') as f:
+                        async for chunk in c.content.iter_chunked(self.chunk_size):
+                            written = time.perf_counter()
+                            hasher.update(chunk)
+                            f.write(chunk)
+                            disk += time.perf_counter() - written
+                            received += len(chunk)
+                            if progress: progress(len(chunk))
+            finally:
+                self._trace('cdn', host, status, time.perf_counter() - start - disk, received, wait=wait, disk=rehash + disk)
+            if expected and hasher.hexdigest() != expected:
+                part_path.unlink()
+                if n == self.max_retries:
+                    raise HashMismatchError(f"{file_to_get.filename} doesn't match its published {algorithm} hash")
+                logger.warning(f"{file_to_get.filename} doesn't match its published hash. Retrying...")
+                raise _Retry()
+            os.replace(part_path, file_path)
+            if stored: await self._adopt(file_path, expected)
+            return file_path
+
+        return await self._retrying(f'Download of {file_to_get.filename}', attempt)
+
+    async def _adopt(self, file_path: Path, sha512: str):
+        start = time.perf_counter()
+        await asyncio.to_thread(self.store.adopt, file_path, sha512)
+        self._trace('store', 'adopt', size=file_path.stat().st_size, disk=time.perf_counter() - start)
+
+    async def fetch_versions(self, query, loaders: list[str] = None, game_versions: list[str] = None):
+        # query is either the mod slug or the mod project id. filters are applied by the API
         url = f'project/{query}/version'
-        all_versions = await self.get_async(url)
-        all_versions.sort(key=lambda v: datetime.fromisoformat(v['date_published']), reverse=True)
+        filters = []
+        if loaders: filters.append(f'loaders={self._encode_ids(loaders)}')
+        if game_versions: filters.append(f'game_versions={self._encode_ids(game_versions)}')
+        if filters: url += '?' + '&'.join(filters)
+        # mods asking for the same list at the same time, e.g. for different targets of a matrix run, share one request
+        task = self._version_lists.get(url)
+        if task is None:
+            task = self._version_lists[url] = asyncio.ensure_future(self._fetch_version_list(url))
+        try:
+            return list(await task)
+        except Exception:
+            self._version_lists.pop(url, None)
+            raise
+
+    async def _fetch_version_list(self, url: str) -> list[Version]:
+        all_versions = [self.versions.add(v) for v in await self.get_async(url)]
+        # ISO 8601 timestamps sort chronologically as strings
+        all_versions.sort(key=lambda v: v.date_published, reverse=True)
         return all_versions
 
-    async def check_dependencies(self, version_id) -> list[str]:
-        url = f'version/{version_id}'
-        self.ratelimit()
-        res = await self.get_async(url)
-        dep = []
-        for d in res['dependencies']:
-            if d['dependency_type'] == 'required':
-                dep.append({
-                    "project_id": d['project_id'],
-                    "version_id": d['version_id']
-                })
-        return dep
+    async def fetch_updates(self, hashes: list[str], algorithm: str, loaders: list[str], game_versions: list[str]) -> dict[str, Version]:
+        # maps each file hash to the latest version of its project for the given loaders and game versions
+        res = await self.post_async('version_files/update', {
+            "hashes": hashes,
+            "algorithm": algorithm,
+            "loaders": loaders,
+            "game_versions": game_versions
+        })
+        return {h: self.versions.add(v) for h, v in res.items()}
+
+    async def identify_files(self, hashes: list[str], algorithm: str = 'sha512') -> dict[str, Version]:
+        # maps each file hash to the version it belongs to. unknown files are left out
+        res = await self.post_async('version_files', {"hashes": hashes, "algorithm": algorithm})
+        return {h: self.versions.add(v) for h, v in res.items()}
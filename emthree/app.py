@@ -1,12 +1,25 @@
-import json, argparse, logging, aiohttp, asyncio, time
+import argparse, logging, asyncio, time
 from pathlib import Path
-from emthree.utils import get_mod, prompt, load_config, load_userlist
+from emthree.utils import prompt, load_config, load_userlist, open_api, open_session, open_cache, open_hash_index, open_store, search_index_path
+from emthree.search import update_index
+from emthree.cache import OfflineCacheMiss
+from emthree.resolver import DependencyResolver
+from emthree.download import DownloadScheduler
+from emthree.trace import Tracer
+from emthree.policy import VersionPolicy, PolicyError
 from emthree.mod import Mod
-from emthree.api import ModrinthAPI
+from emthree.update import find_updates, swap_in
+from emthree.scanner import scan_mods, compare
+from emthree.matrix import resolve_matrix, unattended, compatibility_table
+from emthree.sync import locked_files, read_targets, sync_targets, sync_report
+from emthree.lockfile import read_modlist, write_modlist, mod_entries, explicit_names, is_consistent, load_locked
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 
+# modules only a few commands use, like the jar validator and its process pool or the modpack code and zipfile,
+# are imported by those commands, so every other invocation starts faster. the same goes for aiohttp, see open_session
+
 # TODO: Pass optional arguments to config
 
 async def init(args, config: dict, modlist_file: Path):
@@ -19,154 +32,402 @@ async def init(args, config: dict, modlist_file: Path):
         logger.info(f'{args.userlist} does not exist.')
         return
     
-    setup = False
+    modlist = None
     # check for generated list
-    if (ul and not modlist_file.is_file()) or (ul and modlist_file and prompt('generated list already exists. override?')):
-        setup = True
+    if (ul and not modlist_file.is_file()) or (ul and modlist_file and prompt('generated list already exists. override?', args.yes)):
         mods_to_load = ul       
     elif not ul and modlist_file.is_file():
         logger.info(f'user-made list not specified, and found generated list.')
-        with modlist_file.open('r') as f:
-            modlist = json.load(f)
-            mods_to_load = [m['name'] for m in modlist]
+        modlist = read_modlist(modlist_file)
+        mods_to_load = explicit_names(modlist)
     else:
         logger.info('Neither user supplied list nor generated list can be found. Exiting')
         return
     game_ver = config['game']['game_version']
-    print(*mods_to_load, sep=', ')
-
-    async with aiohttp.ClientSession() as session:
-        api_session = ModrinthAPI(session)
-        mods_tasks = [get_mod(api_session, q, game_ver, is_slug=True) for q in mods_to_load]
-        mods = await asyncio.gather(*mods_tasks)
-        mods = list(filter(None, mods))
-        ids = [mod.project_id for mod in mods]
-        logger.info(f'{len(ids)} mods successfully loaded. Checking for dependencies...')
-
-        # algorithm for recursively searching dependencies
-        dependencies = []
-        dependencies_new = []
-        # first, add known dependencies that aren't already in the list
-        for m in mods:
-            to_add = list(filter(lambda d: d['project_id'] not in ids, m.dependencies))
-            populate_task = [get_mod(api_session, d['project_id'], game_ver, is_slug=False, version_id = d['version_id']) for d in to_add]
-            discovered = []
-            for res in asyncio.as_completed(populate_task):
-                d = await res
-                discovered.append(d)
-                logger.info(f'Found and loaded dependency {d.slug}')
-            discovered = list(filter(None, discovered))
-            dependencies_new += discovered
-            ids += [mod.project_id for mod in discovered]
-        dependencies += dependencies_new
-        
-        # recursively search and add dependencies until no new ones are discovered
-        last_len = 0
-        while len(dependencies) != last_len:
-            discovered_new = []
-            for m in dependencies_new:
-                to_add = list(filter(lambda d: d['project_id'] not in ids, m.dependencies))
-                populate_task = [get_mod(api_session, d['project_id'], game_ver, is_slug=False, version_id = d['version_id']) for d in to_add]
-                discovered = []
-                for res in asyncio.as_completed(populate_task):
-                    d = await res
-                    discovered.append(d)
-                    logger.info(f'Found and loaded dependency {d.slug}')
-                discovered = list(filter(None, discovered))
-                discovered_new += discovered
-                ids += [mod.id for mod in discovered]
-            dependencies += discovered_new
-            dependencies_new = discovered_new
-            last_len = len(dependencies)
-        logger.info(f'Loaded the following {len(mods)} from list:')
-        print(*[m.slug for m in mods], sep=' ')
-        logger.info(f'Found the following {last_len} dependencies:')
-        print(*[d.slug for d in dependencies], sep=' ')
-
-        if prompt('Download all?'):
-            if not any(Path(config['game']['mod_path']).iterdir()):
-                try:
-                    install_task = [m.install(Path(config['game']['mod_path'])) for m in mods + dependencies]
-                    for finished_dl in asyncio.as_completed(install_task):
-                        res = await finished_dl
-                        logger.info(f'Finished downloading {res}')
-                    logger.info(f'Emthree successfully downloaded {len(mods + dependencies)} mods to {config["game"]["mod_path"]}')
-                    
-                except Exception as e:
-                    raise e
-            else:
-                logger.warning(f'Directory is not empty. Aborted download operation.')
+
+    async with open_session(config) as session:
+        api_session = open_api(session, config, args)
+        mods = None
+        if modlist and is_consistent(modlist):
+            # every mod and dependency is pinned, so install exactly those versions without resolving anything
+            logger.info(f'Installing the {len(modlist)} versions pinned in {modlist_file.name}')
+            mods = await load_locked(api_session, modlist, game_ver)
+            roots = [m['project_id'] for m in modlist if m.get('explicit', True)]
+        if mods is None:
+            if modlist: logger.info(f'{modlist_file.name} is incomplete. Resolving the listed mods again.')
+            print(*mods_to_load, sep=', ')
+            resolver = DependencyResolver(api_session, game_ver, policy=VersionPolicy.from_config(config, args))
+            await resolver.resolve(mods_to_load)
+            try:
+                graph = await resolver.settle(args.yes)
+            except PolicyError as e:
+                logger.error(e)
+                return
+            logger.info(f'Loaded the following {len(graph.roots)} from list:')
+            print(*[m.slug for m in graph.root_mods], sep=' ')
+            logger.info(f'Found the following {len(graph.dependencies)} dependencies:')
+            print(*[d.slug for d in graph.dependencies], sep=' ')
+            if graph.unresolved:
+                logger.warning(f'Could not load {len(graph.unresolved)} required dependencies: {", ".join(graph.unresolved)}')
+            mods = graph.root_mods + graph.dependencies
+            roots = graph.roots
+
+        if prompt('Download all?', args.yes):
+            # files that are already in place with the right hash are skipped
+            scheduler = DownloadScheduler(config['game']['mod_path'], concurrency=config['emthree'].get('download_concurrency', 8))
+            installed = await scheduler.run(mods)
+            if api_session.store: api_session.store.save()
+            logger.info(f'Emthree successfully installed {len(installed)} of {len(mods)} mods to {config["game"]["mod_path"]}')
         logger.info(f'Made {api_session.reqcount_total} requests in {round(time.time() - api_session.init_req, 2)} secs\n')
-    if prompt('Write result to file?'):
-        with open(modlist_file, 'w') as f:
-            modlist_dict = [m.create_dict() for m in mods]
-            json.dump(modlist_dict, f, indent=4)
+    if prompt('Write result to file?', args.yes):
+        write_modlist(modlist_file, mod_entries(mods, roots))
     
         
 async def add_mod(args, config, modlist_file):
     mod_name = args.mod
-    with open(modlist_file, "r") as f:
-        known_mods = json.load(f)
+    known_mods = read_modlist(modlist_file)
     if any(m["name"] == mod_name for m in known_mods):
         logger.info("This mod already exists")
         return
-    api_session = ModrinthAPI()
-    mod = await get_mod(api_session, mod_name, config["game"]["game_version"], is_slug=True)
-    if mod: dependencies: list[Mod] = mod.get_dependencies()
-
-    # recursively search dependencies
-    count = len(dependencies)
-    while len(dependencies) != count:
-        for d in dependencies:
-            dependencies += d.get_dependencies()
-        count = len(dependencies)
-    mods_to_add = [mod] + dependencies
-    print(*list(m.slug for m in mods_to_add), sep=', ')
-    if prompt("Add these mods to the list?"):
-        with open(modlist_file, "w") as f:
-            json.dump(known_mods + mods_to_add, f, indent=4)
-        if prompt("Download all?"):
+    known_ids = {m["project_id"] for m in known_mods}
+    async with open_session(config) as session:
+        api_session = open_api(session, config, args)
+        resolver = DependencyResolver(api_session, config["game"]["game_version"], known=known_ids, policy=VersionPolicy.from_config(config, args))
+        await resolver.resolve([mod_name])
+        try:
+            graph = await resolver.settle(args.yes)
+        except PolicyError as e:
+            logger.error(e)
+            return
+        if not graph.roots: return
+        mods_to_add = graph.all_mods
+        print(*list(m.slug for m in mods_to_add), sep=', ')
+        if not prompt("Add these mods to the list?", args.yes): return
+        if prompt("Download all?", args.yes):
+            scheduler = DownloadScheduler(config['game']['mod_path'], concurrency=config['emthree'].get('download_concurrency', 8))
+            installed = await scheduler.run(mods_to_add)
+            if api_session.store: api_session.store.save()
+            logger.info(f'Emthree successfully downloaded {len(installed)} of {len(mods_to_add)} mods to {config["game"]["mod_path"]}')
+        # written after the download, so the list records the file of every mod that was installed
+        write_modlist(modlist_file, known_mods + mod_entries(mods_to_add, graph.roots))
+
+async def update_mods(args, config, modlist_file):
+    if args.offline:
+        # newer versions are looked up with a POST, which is never cached
+        logger.error("update asks Modrinth for newer versions, so it can't run with --offline.")
+        return
+    try:
+        modlist = read_modlist(modlist_file)
+    except FileNotFoundError:
+        print("modlist.json could not be found.")
+        return
+    mod_path = Path(config['game']['mod_path'])
+    game_ver = config['game']['game_version']
+    policy = VersionPolicy.from_config(config, args)
+    async with open_session(config) as session:
+        api_session = open_api(session, config, args)
+        try:
+            updates = await find_updates(api_session, modlist, mod_path, "fabric", game_ver, policy, open_hash_index(), args.yes)
+        except PolicyError as e:
+            logger.error(e)
+            return
+        if not updates:
+            logger.info('All mods are up to date.')
+            return
+        for entry, _, version in updates:
+            print(f"- {entry['name']}: {entry['version']} -> {version.name}")
+        if not prompt(f'Update {len(updates)} mods?', args.yes): return
+
+        mods = [Mod(api_session, e['project_id'], game_ver, is_slug=False, version_id=v.id) for e, _, v in updates]
+        await asyncio.gather(*[m.populate_locked(e['name']) for m, (e, _, _) in zip(mods, updates)])
+        # new versions can require mods that aren't installed yet
+        resolver = DependencyResolver(api_session, game_ver, known={m['project_id'] for m in modlist}, policy=policy)
+        await resolver.expand(mods)
+        try:
+            graph = await resolver.settle(args.yes)
+        except PolicyError as e:
+            logger.error(e)
+            return
+        if graph.all_mods: logger.info(f'Found {len(graph.all_mods)} new dependencies: {", ".join(d.slug for d in graph.all_mods)}')
+
+        # download everything next to the mods folder first, then swap it in
+        staging = mod_path / '.emthree-staging'
+        staging.mkdir(exist_ok=True)
+        scheduler = DownloadScheduler(staging, concurrency=config['emthree'].get('download_concurrency', 8))
+        await scheduler.run(mods + graph.all_mods)
+        swap_in(staging, mod_path, [(m, path) for m, (_, path, _) in zip(mods, updates)] + [(d, None) for d in graph.all_mods], api_session.store)
+        if api_session.store: api_session.store.save()
+        logger.info(f'Made {api_session.reqcount_total} requests in {round(time.time() - api_session.init_req, 2)} secs\n')
+
+    # mods whose new version couldn't be downloaded keep their old jar, so they stay pinned to the old version
+    updated = {m.project_id: m for m in mods if m.installed}
+    for i, entry in enumerate(modlist):
+        if entry['project_id'] in updated:
+            modlist[i] = mod_entries([updated[entry['project_id']]], [entry['project_id']] if entry.get('explicit', True) else [])[0]
+    write_modlist(modlist_file, modlist + mod_entries([d for d in graph.all_mods if d.installed], []))
+    logger.info(f'Updated {len(updated)} mods in {config["game"]["mod_path"]}')
+    if len(updated) < len(mods): logger.warning(f'{len(mods) - len(updated)} mods could not be updated and were left at their current version')
+
+async def sync(args, config, modlist_file):
+    # brings many mods folders in line with one lockfile, resolving and downloading only once for all of them
+    targets = [Path(t) for t in args.targets or []]
+    if args.targets_file:
+        try:
+            targets += read_targets(args.targets_file)
+        except FileNotFoundError:
+            logger.error(f'{args.targets_file} does not exist.')
+            return
+    # the same folder given twice would be synced against itself
+    targets = list({t.resolve(): t for t in targets}.values())
+    if not targets:
+        logger.error('No targets given. Pass them with --targets or --targets-file.')
+        return
+    try:
+        modlist = read_modlist(modlist_file)
+    except FileNotFoundError:
+        print("modlist.json could not be found.")
+        return
+    game_ver = config['game']['game_version']
+    async with open_session(config) as session:
+        api_session = open_api(session, config, args)
+        files = locked_files(modlist) if is_consistent(modlist) else None
+        resolved = None
+        if files is None:
+            logger.info(f'{modlist_file.name} is incomplete. Resolving the listed mods once for every target.')
+            resolver = DependencyResolver(api_session, game_ver, policy=VersionPolicy.from_config(config, args))
+            await resolver.resolve(explicit_names(modlist))
             try:
-                install_task = [m.install(Path(config['game']['mod_path'])) for m in mods_to_add]
-                async for finished_dl in asyncio.as_completed(install_task):
-                    res = await finished_dl
-                    logger.info(f'Finished downloading {res}')
-                logger.info(f'Emthree successfully downloaded {len(mods_to_add)} mods to {config["game"]["mod_path"]}')
-                
-            except Exception as e:
-                raise e
+                graph = await resolver.settle(args.yes)
+            except PolicyError as e:
+                logger.error(e)
+                return
+            mods = graph.root_mods + graph.dependencies
+            resolved = mod_entries(mods, graph.roots)
+            # sync doesn't touch the mods folder the list tracks, so whatever it recorded as installed there still is
+            installed = {m.get('project_id') or m['name']: m['file'] for m in modlist if m.get('file')}
+            for entry in resolved:
+                entry['file'] = installed.get(entry['project_id'], installed.get(entry['name'], entry['file']))
+            files = [m.primary_file for m in mods if m.primary_file]
+            projects = {m.project_id for m in mods}
+        else:
+            projects = {m['project_id'] for m in modlist}
+        if not prompt(f'Sync {len(files)} mods to {len(targets)} targets?', args.yes): return
+        if resolved is not None:
+            write_modlist(modlist_file, resolved)
+            logger.info(f'Wrote the resolved versions to {modlist_file.name}, so every target gets the same ones')
+        start = time.time()
+        plans = await sync_targets(api_session, files, targets, concurrency=config['emthree'].get('download_concurrency', 8), projects=projects)
+        if api_session.store: api_session.store.save()
+        logger.info(f'Synced {len(targets)} targets with {api_session.reqcount_total} requests in {round(time.time() - start, 2)} secs\n')
+    print(sync_report(plans, len(files)))
 
 async def list_installed(args, config, modlist_file):
     try:
-        with modlist_file.open('r') as f:
-            modlist = json.load(f)
+        modlist = read_modlist(modlist_file)
     except FileNotFoundError:
         print("modlist.json could not be found.")
         return
-    for mod in modlist:
-        if 'filename' in mod:
-            installed = (Path(config['game']['mod_path']) / mod['filename']).is_file()
-        else: installed = False
-        print(f'- {mod['name']}: {mod['filename'] if installed else "NOT INSTALLED"}')
-    print("Caution: Emthree only tracks mods listed in modlist.json. It has no knowledge of mods you may have added manually.")
+    jars = await asyncio.to_thread(scan_mods, Path(config['game']['mod_path']), open_hash_index())
+    report = compare(modlist, jars)
+    for entry, jar in report.tracked:
+        print(f"- {entry['name']}: {jar.name}")
+    for entry, jar in report.modified:
+        print(f"- {entry['name']}: {jar.name} (MODIFIED, doesn't match {entry['version']})")
+    for entry in report.missing:
+        print(f"- {entry['name']}: NOT INSTALLED")
+    if not report.untracked: return
+    identified = {}
+    if args.identify:
+        async with open_session(config) as session:
+            api_session = open_api(session, config, args)
+            try:
+                versions = await api_session.identify_files([j.sha512 for j in report.untracked])
+                projects = await asyncio.gather(*[api_session.get_project(v.project_id) for v in versions.values()])
+                identified = {h: f"{p['slug'] if p else v.project_id} {v.version_number}" for (h, v), p in zip(versions.items(), projects)}
+            except OfflineCacheMiss:
+                logger.warning("These jars haven't been looked up before, so they can't be identified while running offline")
+    print(f'{len(report.untracked)} jars in the mods folder are not tracked by emthree:')
+    for jar in report.untracked:
+        print(f"- {jar.name}" + (f" ({identified[jar.sha512]} on Modrinth)" if jar.sha512 in identified else ""))
 
-async def main():
-    config = load_config(prod=False)
+async def check_mods(args, config, modlist_file):
+    # works entirely offline, from the fabric.mod.json inside each jar
+    from emthree.validate import read_mods_folder, validate
+    start = time.time()
+    metas, not_fabric, unreadable = await asyncio.to_thread(read_mods_folder, Path(config['game']['mod_path']))
+    problems = validate(metas, config['game']['game_version'])
+    logger.info(f'Checked {len(metas)} mods, bundled ones included, in {round(time.time() - start, 2)} secs')
+    for jar in not_fabric:
+        logger.warning(f'{jar} is not a Fabric mod')
+    for jar, error in unreadable.items():
+        logger.warning(f'Could not read {jar}, so it was left out of the check: {error}')
+    for problem in problems:
+        logger.error(problem)
+    if not problems: logger.info('No missing or conflicting mods found.')
+
+async def matrix(args, config, modlist_file):
+    # resolves the mod list for every combination of game version and loader, without downloading anything
+    if args.userlist:
+        mods_to_load = load_userlist(Path(args.userlist))
+        if not mods_to_load: return
+    elif modlist_file.is_file():
+        mods_to_load = explicit_names(read_modlist(modlist_file))
+    else:
+        logger.info('Neither user supplied list nor generated list can be found. Exiting')
+        return
+    game_versions = args.game_versions or [config['game']['game_version']]
+    targets = [(loader, gv) for gv in game_versions for loader in args.loaders]
+    async with open_session(config) as session:
+        api_session = open_api(session, config, args)
+        graphs = await resolve_matrix(api_session, mods_to_load, targets, unattended(VersionPolicy.from_config(config, args)))
+        logger.info(f'Resolved {len(targets)} targets with {api_session.reqcount_total} requests in {round(time.time() - api_session.init_req, 2)} secs\n')
+    print(compatibility_table(mods_to_load, graphs))
+    if args.no_write: return
+    for (loader, gv), graph in graphs.items():
+        # a complete lockfile per target. renaming one to modlist.json installs exactly that set
+        target_file = modlist_file.with_name(f'modlist-{gv}-{loader}.json')
+        write_modlist(target_file, mod_entries(graph.root_mods + graph.dependencies, graph.roots))
+        logger.info(f'Wrote {target_file}')
+
+async def export_pack(args, config, modlist_file):
+    from emthree.mrpack import build_index, write_pack
+    try:
+        modlist = read_modlist(modlist_file)
+    except FileNotFoundError:
+        print("modlist.json could not be found.")
+        return
+    pack_path = Path(args.pack)
+    index = build_index(modlist, args.name or pack_path.stem, args.version, config['game']['game_version'],
+                        loader_version=args.loader_version or config['game'].get('loader_version'))
+    overrides = await asyncio.to_thread(write_pack, pack_path, index, args.overrides or [])
+    logger.info(f'Exported {len(index["files"])} mods and {overrides} override files to {pack_path}')
+
+async def import_pack(args, config, modlist_file):
+    import zipfile
+    from emthree.mrpack import PackError, read_index, pack_files, extract_overrides
+    mod_path = Path(config['game']['mod_path'])
+    game_ver = config['game']['game_version']
+    if modlist_file.is_file() and not prompt(f'{modlist_file.name} already exists. Replace it with the modpack?', args.yes): return
+    try:
+        archive = zipfile.ZipFile(args.pack)
+    except (FileNotFoundError, zipfile.BadZipFile) as e:
+        logger.error(f'Could not open {args.pack}: {e}')
+        return
+    with archive:
+        try:
+            index = read_index(archive)
+            files = pack_files(index, mod_path)
+        except PackError as e:
+            logger.error(e)
+            return
+        pack_game_ver = index.get('dependencies', {}).get('minecraft')
+        if pack_game_ver and pack_game_ver != game_ver:
+            logger.warning(f'{index.get("name")} is made for {pack_game_ver}, but the config is set to {game_ver}')
+        logger.info(f'Installing {len(files)} files from {index.get("name")} {index.get("versionId")}')
+        for _, directory in files: directory.mkdir(parents=True, exist_ok=True)
+        async with open_session(config) as session:
+            api_session = open_api(session, config, args)
+            scheduler = DownloadScheduler(mod_path, concurrency=config['emthree'].get('download_concurrency', 8))
+            paths = await scheduler.run_files(api_session, files)
+            if api_session.store: api_session.store.save()
+            overrides = await asyncio.to_thread(extract_overrides, archive, mod_path)
+            logger.info(f'Installed {len([p for p in paths if p])} files and {overrides} override files')
+
+            # look the mods up by hash, so the mod list can track and update them
+            jars = {f.sha512: directory / f.filename for f, directory in files if f.sha512 and directory == mod_path}
+            try:
+                versions = await api_session.identify_files(list(jars))
+            except OfflineCacheMiss:
+                logger.warning(f"The pack's mods can't be looked up while running offline, so {modlist_file.name} was left unchanged")
+                return
+            projects = await asyncio.gather(*[api_session.get_project(v.project_id) for v in versions.values()])
+            mods = [Mod(api_session, v.project_id, game_ver, is_slug=False, version_id=v.id) for v in versions.values()]
+            await asyncio.gather(*[m.populate_locked(p['slug'] if p else v.project_id) for m, v, p in zip(mods, versions.values(), projects)])
+            installed = set(paths)
+            for m, digest in zip(mods, versions):
+                m.path = jars[digest]
+                # jars that failed or were skipped, e.g. offline, are recorded as not installed
+                m.installed = m.path in installed
+    unknown = len(jars) - len(versions)
+    if unknown: logger.warning(f'{unknown} mods in the pack are not on Modrinth and are not tracked in the mod list')
+    # mods no other mod requires are the ones the pack author picked
+    required = {d['project_id'] for m in mods for d in m.dependencies}
+    write_modlist(modlist_file, mod_entries(mods, [m.project_id for m in mods if m.project_id not in required]))
+    logger.info(f'Wrote {len(mods)} mods to {modlist_file}')
+
+async def search_mods(args, config, modlist_file):
+    # answered from the local index, which grows with every project emthree fetches. --seed adds Modrinth's most downloaded mods
+    seed = []
+    if args.seed:
+        async with open_session(config) as session:
+            api_session = open_api(session, config, args)
+            pages = await asyncio.gather(*[api_session.search_projects(offset=100 * page) for page in range(args.seed)])
+            seed = [hit for hits in pages for hit in hits]
+    start = time.perf_counter()
+    # the cache's connection belongs to this thread, and indexing what's new since the last search is quick anyway
+    index = update_index(search_index_path(), open_cache(args), seed)
+    if not index.n_docs:
+        print('Nothing to search yet. Add some mods, or fill the index with emthree search --seed PAGES.')
+        index.close()
+        return
+    try:
+        results = index.search(' '.join(args.query), loader=args.loader, game_version=args.game_version, limit=args.limit)
+    finally:
+        index.close()
+    logger.info(f'{len(results)} results from {index.n_docs} projects in {round((time.perf_counter() - start) * 1000, 1)} ms')
+    if not results: print(f"No projects emthree has seen match {' '.join(args.query)}. Try --seed to index more of Modrinth.")
+    for doc in results:
+        print(f"- {doc['slug']}: {doc['title']} ({', '.join(doc['loaders']) or 'no loader listed'}, {doc['downloads']} downloads)")
+        if doc['description']: print(f"    {doc['description'][:100]}")
 
+async def collect_garbage(args, config, modlist_file):
+    store = open_store(config)
+    if store is None:
+        logger.info('The jar store is disabled in the config.')
+        return
+    removed, freed = await asyncio.to_thread(store.gc)
+    logger.info(f'Removed {removed} jars no profile uses anymore, freeing {round(freed / 1024 / 1024, 1)} MiB')
+
+async def main():
     # command arguments initiation
     parser = argparse.ArgumentParser(
         prog="emthree",
         description="A CLI tool to automatically download and maintain Minecraft mods from Modrinth",
     )
 
+    parser.add_argument("--config",
+                        help="Path to a config file to use instead of the default one")
+
     subparsers = parser.add_subparsers(required=True)
 
-    parser_add = subparsers.add_parser('add')
+    # options shared by every command that talks to Modrinth
+    network = argparse.ArgumentParser(add_help=False)
+    network.add_argument("--offline", action="store_true",
+                        help="Only use cached API responses")
+    network.add_argument("--no-cache", action="store_true",
+                        help="Don't read or write the response cache")
+    network.add_argument("--no-store", action="store_true",
+                        help="Don't install jars from, or add them to, the shared jar store")
+    network.add_argument("--trace", metavar="FILE",
+                        help="Write every request to FILE as JSON lines and print a summary per endpoint")
+    network.add_argument("-y", "--yes", action="store_true",
+                        help="Answer yes to every prompt")
+    # version selection policy, overrides the "policy" section of the config
+    network.add_argument("--prefer", choices=VersionPolicy.PREFER,
+                        help="Which version to use when a newer alpha/beta exists alongside a release")
+    network.add_argument("--legacy", choices=VersionPolicy.LEGACY,
+                        help="Whether to use mods that don't support the configured game version")
+    network.add_argument("--no-beta", action="store_true",
+                        help="Never use alpha/beta versions")
+    network.add_argument("--allow-legacy", nargs="+", metavar="SLUG",
+                        help="Mods that may use versions made for other game versions")
+
+    parser_add = subparsers.add_parser('add', parents=[network])
     parser_add.set_defaults(func=add_mod)
     parser_add.add_argument('mod', type=str)
 
 
-    parser_init = subparsers.add_parser('init')
+    parser_init = subparsers.add_parser('init', parents=[network])
     parser_init.set_defaults(func=init)
     parser_init.add_argument("-u", "--userlist",
                         help="Path to CSV list containing mods")
@@ -174,18 +435,89 @@ async def main():
                         help="Path to download mods to, if NOT specified in config")
     parser_init.add_argument("-i", "--install")
 
+    parser_update = subparsers.add_parser('update', parents=[network])
+    parser_update.set_defaults(func=update_mods)
+
+    parser_check = subparsers.add_parser('check')
+    parser_check.set_defaults(func=check_mods)
+
+    parser_matrix = subparsers.add_parser('matrix', parents=[network])
+    parser_matrix.set_defaults(func=matrix)
+    parser_matrix.add_argument("-g", "--game-versions", nargs="+", metavar="VERSION",
+                        help="Game versions to resolve for. Defaults to the one in the config")
+    parser_matrix.add_argument("-l", "--loaders", nargs="+", default=["fabric"], metavar="LOADER",
+                        help="Mod loaders to resolve for")
+    parser_matrix.add_argument("-u", "--userlist",
+                        help="Path to a list of mods to use instead of the mod list")
+    parser_matrix.add_argument("--no-write", action="store_true",
+                        help="Only print the table, without writing a lockfile per target")
+
+    parser_export = subparsers.add_parser('export')
+    parser_export.set_defaults(func=export_pack)
+    parser_export.add_argument('pack', help="Path of the .mrpack to write")
+    parser_export.add_argument("-n", "--name", help="Name of the modpack. Defaults to the file name")
+    parser_export.add_argument("-v", "--version", default="1.0.0", help="Version of the modpack")
+    parser_export.add_argument("--loader-version",
+                        help="Fabric loader version the pack needs, if not set as loader_version in the config")
+    parser_export.add_argument("-o", "--overrides", nargs="+", metavar="PATH",
+                        help="Files and folders, such as config, to bundle as overrides")
+
+    parser_import = subparsers.add_parser('import', parents=[network])
+    parser_import.set_defaults(func=import_pack)
+    parser_import.add_argument('pack', help="Path of the .mrpack to install")
+
+    parser_sync = subparsers.add_parser('sync', parents=[network])
+    parser_sync.set_defaults(func=sync)
+    parser_sync.add_argument("-t", "--targets", nargs="+", metavar="DIR",
+                        help="Mods folders to bring in line with the mod list")
+    parser_sync.add_argument("-f", "--targets-file", metavar="FILE",
+                        help="File listing one mods folder per line")
+
+    parser_search = subparsers.add_parser('search')
+    parser_search.set_defaults(func=search_mods, offline=False, no_store=True)
+    parser_search.add_argument('query', nargs="+")
+    parser_search.add_argument("-l", "--loader",
+                        help="Only show mods for this loader")
+    parser_search.add_argument("-g", "--game-version",
+                        help="Only show mods for this game version")
+    parser_search.add_argument("-n", "--limit", type=int, default=10,
+                        help="Number of results to show")
+    parser_search.add_argument("--seed", type=int, default=0, metavar="PAGES",
+                        help="First add this many pages of 100 mods from Modrinth's search to the index")
+    parser_search.add_argument("--no-cache", action="store_true",
+                        help="Don't add cached projects to the index")
+    parser_search.add_argument("--trace", metavar="FILE",
+                        help="Write every request to FILE as JSON lines and print a summary per endpoint")
+
+    parser_gc = subparsers.add_parser('gc')
+    parser_gc.set_defaults(func=collect_garbage)
+
     parser_list = subparsers.add_parser('list')
     parser_list.set_defaults(func=list_installed)
+    parser_list.add_argument("--identify", action="store_true",
+                        help="Look up untracked jars on Modrinth by their hash")
+    parser_list.add_argument("--offline", action="store_true",
+                        help="Only use cached API responses")
+    parser_list.add_argument("--no-cache", action="store_true",
+                        help="Don't read or write the response cache")
+    parser_list.add_argument("--trace", metavar="FILE",
+                        help="Write every request to FILE as JSON lines and print a summary per endpoint")
+
+    args = parser.parse_args()
+    config = load_config(path=args.config)
 
     list_path = Path(config["emthree"]["list_path"])
     if not list_path.is_dir():
-        list_path.mkdir()
+        list_path.mkdir(parents=True)
     modlist_file = list_path / 'modlist.json'
 
-    args = parser.parse_args()
-
-    
-    await args.func(args, config=config, modlist_file=modlist_file)
+    args.tracer = Tracer(args.trace) if getattr(args, 'trace', None) else None
+    try:
+        await args.func(args, config=config, modlist_file=modlist_file)
+    finally:
+        if args.tracer:
+            args.tracer.close()
+            print(args.tracer.report())
     
 
 
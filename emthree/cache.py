@@ -0,0 +1,141 @@
+import atexit, json, logging, sqlite3, time, zlib
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+class OfflineCacheMiss(LookupError):
+    pass
+
+class CacheEntry():
+    def __init__(self, url: str, body: bytes, etag: str, last_modified: str, fetched_at: float, ttl: float):
+        self.url = url
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at
+        self.ttl = ttl
+
+    @property
+    def fresh(self) -> bool:
+        return time.time() - self.fetched_at < self.ttl
+
+    def json(self):
+        return json.loads(self.body)
+
+class ResponseCache():
+    # persistent cache of API responses, shared by every profile on the machine.
+    # entries past their TTL are revalidated with If-None-Match/If-Modified-Since instead of refetched
+    TTLS = (
+        # (url prefix, seconds). first match wins
+        ('version/', 7 * 86400), # published versions practically never change
+        ('project/', 86400),
+    )
+    VERSION_LIST_TTL = 3600 # new releases show up here first, so keep it short
+    DEFAULT_TTL = 600
+    FLUSH_EVERY = 512 # reads whose access times are kept in memory before they are written out
+
+    def __init__(self, path: Path, max_bytes: int = 256 * 1024 * 1024):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.db = sqlite3.connect(path)
+        # a commit only has to reach the write-ahead log, not the database file, and readers don't block writers
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                body BLOB NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                size INTEGER NOT NULL
+            )""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses (accessed_at)")
+        self.db.commit()
+        # reads only change an entry's LRU position, so they are batched instead of committed one by one
+        self._accessed: dict[str, float] = {}
+        self._size: int = self.size() # kept up to date by put and _evict, so writes don't have to sum the table
+        atexit.register(self.flush)
+
+    def ttl(self, url: str) -> float:
+        if url.startswith('project/') and url.split('?')[0].endswith('/version'):
+            return self.VERSION_LIST_TTL
+        for prefix, ttl in self.TTLS:
+            if url.startswith(prefix): return ttl
+        return self.DEFAULT_TTL
+
+    def get(self, url: str) -> CacheEntry:
+        row = self.db.execute("SELECT body, etag, last_modified, fetched_at FROM responses WHERE url = ?", (url,)).fetchone()
+        if row is None: return None
+        self._accessed[url] = time.time()
+        if len(self._accessed) >= self.FLUSH_EVERY: self.flush()
+        body, etag, last_modified, fetched_at = row
+        return CacheEntry(url, zlib.decompress(body), etag, last_modified, fetched_at, self.ttl(url))
+
+    def put(self, url: str, body: bytes, etag: str = None, last_modified: str = None):
+        now = time.time()
+        compressed = zlib.compress(body)
+        replaced = self.db.execute("SELECT size FROM responses WHERE url = ?", (url,)).fetchone()
+        self.db.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (url, compressed, etag, last_modified, now, now, len(compressed))
+        )
+        self._accessed.pop(url, None)
+        self._size += len(compressed) - (replaced[0] if replaced else 0)
+        self.flush()
+        if self._size > self.max_bytes: self._evict()
+
+    def put_json(self, url: str, data):
+        self.put(url, json.dumps(data, separators=(',', ':')).encode())
+
+    def touch(self, url: str):
+        # the server confirmed the entry is still current
+        now = time.time()
+        self.db.execute("UPDATE responses SET fetched_at = ?, accessed_at = ? WHERE url = ?", (now, now, url))
+        self.db.commit()
+
+    def documents(self, prefix: str, since: float = 0.0):
+        # the JSON objects cached under prefix since a point in time, without touching their LRU position.
+        # version lists and other nested paths are left out, e.g. project/{id} but not project/{id}/version
+        rows = self.db.execute(
+            "SELECT url, body FROM responses WHERE url LIKE ? AND fetched_at > ?",
+            (prefix.replace('%', '') + '%', since)
+        ).fetchall()
+        for url, body in rows:
+            if '/' in url[len(prefix):] or '?' in url: continue
+            data = json.loads(zlib.decompress(body))
+            if isinstance(data, dict): yield data
+
+    def flush(self):
+        # writes out the batched access times, and commits whatever else is pending along with them
+        if self._accessed:
+            self.db.executemany("UPDATE responses SET accessed_at = ? WHERE url = ?", [(t, u) for u, t in self._accessed.items()])
+            self._accessed.clear()
+        self.db.commit()
+
+    def size(self) -> int:
+        return self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def _evict(self):
+        # other processes share the cache, so the running total is checked against the table before evicting
+        total = self._size = self.size()
+        if total <= self.max_bytes: return
+        # drop least recently used entries until there is some headroom again
+        target = self.max_bytes * 0.9
+        evicted = 0
+        for url, size in self.db.execute("SELECT url, size FROM responses ORDER BY accessed_at").fetchall():
+            if total <= target: break
+            self.db.execute("DELETE FROM responses WHERE url = ?", (url,))
+            total -= size
+            evicted += 1
+        self.db.commit()
+        self._size = total
+        logger.debug(f'evicted {evicted} cached responses')
+
+    def close(self):
+        self.flush()
+        atexit.unregister(self.flush)
+        self.db.close()
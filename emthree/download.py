@@ -0,0 +1,119 @@
+import asyncio, logging, time
+from collections import deque
+from pathlib import Path
+from emthree.mod import Mod
+from emthree.versions import ModFile
+from typing import TYPE_CHECKING
+if TYPE_CHECKING: from emthree.api import ModrinthAPI
+
+logger = logging.getLogger(__name__)
+
+class TransferProgress():
+    def __init__(self, total_files: int, total_bytes: int):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.done_files = 0
+        self.done_bytes = 0 # bytes of finished files, including ones that were already on disk
+        self.received = 0 # bytes actually transferred over the network
+        self.failed_files = 0
+        self._inflight = 0
+        self.started = time.monotonic()
+
+    def advance(self, n: int):
+        self.received += n
+        self._inflight += n
+
+    def finish(self, size: int, received: int):
+        self._inflight -= received
+        self.done_bytes += size
+        self.done_files += 1
+
+    def fail(self, size: int, received: int):
+        # what a failed file received still counts towards the rate, but its bytes are no longer expected
+        self._inflight -= received
+        self.total_bytes -= size
+        self.failed_files += 1
+
+    @property
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.received / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self) -> float:
+        remaining = self.total_bytes - self.done_bytes - self._inflight
+        return remaining / self.rate if self.rate > 0 else None
+
+    def report(self) -> str:
+        mib = 1024 * 1024
+        eta = f'{round(self.eta)}s' if self.eta is not None else '?'
+        return (f'{self.done_files}/{self.total_files} files, '
+                f'{round((self.done_bytes + self._inflight) / mib, 1)}/{round(self.total_bytes / mib, 1)} MiB, '
+                f'{round(self.rate / mib, 2)} MiB/s, ETA {eta}'
+                + (f', {self.failed_files} failed' if self.failed_files else ''))
+
+class DownloadScheduler():
+    # downloads the largest files first so a big jar doesn't start last and hold up the whole install.
+    # the number of workers bounds how many downloads hit the CDN at the same time
+    def __init__(self, install_dir: Path, concurrency: int = 8, report_interval: float = 2.0):
+        self.install_dir = Path(install_dir)
+        self.concurrency = concurrency
+        self.report_interval = report_interval
+        self.progress: TransferProgress = None
+        self.skipped: list[str] = [] # files that couldn't be fetched, e.g. while running offline
+        self.failed: dict[str, str] = {} # file name -> error, for downloads that raised
+
+    async def run(self, mods: list[Mod]) -> list[Path]:
+        jobs = [(m.primary_file, m) for m in mods]
+        return await self._run([(f, lambda advance, m=m: m.install(self.install_dir, advance)) for f, m in jobs if f])
+
+    async def run_files(self, api: 'ModrinthAPI', files: list[tuple[ModFile, Path]]) -> list[Path]:
+        # files that don't belong to a Mod, e.g. the ones listed in a .mrpack, each going to its own directory
+        return await self._run([(f, lambda advance, f=f, d=d: api.download(f, d, advance)) for f, d in files])
+
+    async def _run(self, jobs: list[tuple]) -> list[Path]:
+        # jobs are (file, function that downloads it given a progress callback)
+        jobs.sort(key=lambda j: j[0].size, reverse=True)
+        self.progress = TransferProgress(len(jobs), sum(f.size for f, _ in jobs))
+        self.skipped = []
+        self.failed = {}
+        queue = deque(jobs)
+        results = []
+        reporter = asyncio.ensure_future(self._report())
+        try:
+            await asyncio.gather(*[self._worker(queue, results) for _ in range(min(self.concurrency, len(jobs)))])
+        finally:
+            reporter.cancel()
+        elapsed = time.monotonic() - self.progress.started
+        logger.info(f'Downloaded {round(self.progress.received / 1024 / 1024, 1)} MiB in {round(elapsed, 2)} secs ({self.progress.report()})')
+        if self.skipped: logger.warning(f'Skipped {len(self.skipped)} files: {", ".join(self.skipped)}')
+        for filename, error in self.failed.items():
+            logger.error(f'Could not download {filename}: {error}')
+        return results
+
+    async def _worker(self, queue: deque, results: list[Path]):
+        while queue:
+            file_to_get, install = queue.popleft()
+            received = 0
+            def advance(n):
+                nonlocal received
+                received += n
+                self.progress.advance(n)
+            try:
+                res = await install(advance)
+            except Exception as e:
+                # one broken download shouldn't cancel the others
+                self.progress.fail(file_to_get.size, received)
+                self.failed[file_to_get.filename] = str(e) or e.__class__.__name__
+                continue
+            self.progress.finish(file_to_get.size or received, received)
+            if res is None:
+                self.skipped.append(file_to_get.filename)
+                continue
+            logger.info(f'Finished downloading {res}')
+            results.append(res)
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            logger.info(self.progress.report())
@@ -0,0 +1,21 @@
+import hashlib
+from pathlib import Path
+
+# strongest first
+ALGORITHMS = ('sha512', 'sha1')
+
+def pick_hash(file_to_get) -> tuple[str, str]:
+    # returns the strongest (algorithm, hexdigest) pair Modrinth published for a ModFile
+    hashes = file_to_get.hashes
+    for algorithm in ALGORITHMS:
+        if hashes.get(algorithm): return algorithm, hashes[algorithm]
+    return None, None
+
+def hash_into(hasher, path: Path, chunk_size: int = 1024 * 1024):
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            hasher.update(chunk)
+    return hasher
+
+def hash_file(path: Path, algorithm: str = 'sha512') -> str:
+    return hash_into(hashlib.new(algorithm), path).hexdigest()
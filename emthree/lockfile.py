@@ -0,0 +1,51 @@
+import asyncio, json, logging
+from pathlib import Path
+from emthree.mod import Mod
+from typing import TYPE_CHECKING
+if TYPE_CHECKING: from emthree.api import ModrinthAPI
+
+logger = logging.getLogger(__name__)
+
+# modlist.json doubles as a lockfile: every mod, dependencies included, is pinned to a version id
+
+def read_modlist(modlist_file: Path) -> list[dict]:
+    with Path(modlist_file).open('r') as f:
+        return json.load(f)
+
+def write_modlist(modlist_file: Path, entries: list[dict]):
+    with Path(modlist_file).open('w') as f:
+        json.dump(entries, f, indent=4)
+
+def mod_entries(mods: list[Mod], roots: list[str]) -> list[dict]:
+    # explicit marks the mods the user asked for, as opposed to ones pulled in as dependencies
+    roots = set(roots)
+    entries = []
+    for m in mods:
+        entry = m.create_dict()
+        if not entry: continue
+        entry['explicit'] = m.project_id in roots
+        entries.append(entry)
+    return entries
+
+def explicit_names(modlist: list[dict]) -> list[str]:
+    # lists written before dependencies were recorded only contain explicit mods
+    return [m['name'] for m in modlist if m.get('explicit', True)]
+
+def is_consistent(modlist: list[dict]) -> bool:
+    # a lock can be installed as is when every mod is pinned and every required dependency is in it
+    ids = {m.get('project_id') for m in modlist}
+    for m in modlist:
+        if not m.get('project_id') or not m.get('version_id'): return False
+        for d in m.get('dependencies', []):
+            if d['project_id'] and d['project_id'] not in ids: return False
+    return True
+
+async def load_locked(api: 'ModrinthAPI', modlist: list[dict], game_version: str) -> list[Mod]:
+    # the pinned versions are looked up in bulk. no project documents or version lists are needed
+    mods = [Mod(api, m['project_id'], game_version, is_slug=False, version_id=m['version_id']) for m in modlist]
+    results = await asyncio.gather(*[mod.populate_locked(m['name']) for mod, m in zip(mods, modlist)])
+    failed = [m['name'] for m, r in zip(modlist, results) if r is None]
+    if failed:
+        logger.warning(f'Could not load the pinned versions of {", ".join(failed)}')
+        return None
+    return mods
@@ -0,0 +1,69 @@
+import asyncio, logging
+from emthree.mod import Mod
+from emthree.policy import VersionPolicy
+from emthree.resolver import DependencyResolver, ResolvedGraph
+from typing import TYPE_CHECKING
+if TYPE_CHECKING: from emthree.api import ModrinthAPI
+
+logger = logging.getLogger(__name__)
+
+# resolves one list of mods for several (loader, game version) targets at once. every target gets its own
+# resolver, but they all share the API session, so each project and each version list is fetched only once
+
+def unattended(policy: VersionPolicy) -> VersionPolicy:
+    # a matrix run reports on versions instead of asking about them. legacy versions are kept and shown as such
+    return VersionPolicy(
+        prefer='release' if policy.prefer in ('ask', 'fail') else policy.prefer,
+        legacy='allow' if policy.legacy in ('ask', 'fail') else policy.legacy,
+        allow_beta=policy.allow_beta,
+        allow_legacy=list(policy.allow_legacy),
+    )
+
+async def resolve_matrix(api: 'ModrinthAPI', queries: list[str], targets: list[tuple[str, str]], policy: VersionPolicy) -> dict[tuple[str, str], ResolvedGraph]:
+    # targets are (loader, game version) pairs. version lists are fetched for every loader and game version
+    # at once, and each target picks its versions from them, see Mod.shared_loaders
+    loaders = sorted({loader for loader, _ in targets})
+    resolvers = [DependencyResolver(api, gv, policy=policy, loader=loader, shared_loaders=loaders) for loader, gv in targets]
+    graphs = await asyncio.gather(*[r.resolve(queries) for r in resolvers])
+    return dict(zip(targets, graphs))
+
+def label(mod: Mod) -> str:
+    version = mod.selected_version
+    if not version: return 'missing'
+    kind = 'ok' if version.version_type == 'release' else version.version_type
+    return kind if mod.game_version in version.game_versions else f'legacy {kind}'
+
+def compatibility_table(queries: list[str], graphs: dict[tuple[str, str], ResolvedGraph]) -> str:
+    # one row per mod, explicit ones first, and one column per target
+    targets = list(graphs)
+    names: dict[str, str] = {} # project id -> slug
+    roots: list[str] = []
+    for graph in graphs.values():
+        for pid, mod in graph.mods.items(): names.setdefault(pid, mod.slug)
+        for pid in graph.roots:
+            if pid not in roots: roots.append(pid)
+    found = {names[pid].lower() for pid in roots}
+    missing = [q for q in queries if q.lower() not in found]
+    dependencies = sorted((pid for pid in names if pid not in roots), key=lambda pid: names[pid])
+
+    columns = [f'{gv} {loader}' for loader, gv in targets]
+    width = max([len(n) for n in list(names.values()) + missing] + [3]) + 2
+    cell = max([len(c) for c in columns] + [14]) + 2
+    lines = [f'{"mod":<{width}}' + ''.join(f'{c:<{cell}}' for c in columns)]
+    for pid in roots:
+        lines.append(f'{names[pid]:<{width}}' + ''.join(f'{label(g.mods[pid]) if pid in g.mods else "missing":<{cell}}' for g in graphs.values()))
+    for query in missing:
+        lines.append(f'{query:<{width}}' + ''.join(f'{"missing":<{cell}}' for _ in graphs))
+    if dependencies:
+        lines.append('dependencies:')
+        for pid in dependencies:
+            lines.append(f'{names[pid]:<{width}}' + ''.join(f'{label(g.mods[pid]) if pid in g.mods else "":<{cell}}' for g in graphs.values()))
+    lines.append('')
+    for (loader, gv), graph in graphs.items():
+        labels = [label(m) for m in graph.all_mods]
+        ready = sum(1 for l in labels if l == 'ok')
+        summary = f'{gv} {loader}: {ready}/{len(labels)} mods have a release for this version'
+        if len(graph.roots) < len(queries): summary += f', {len(queries) - len(graph.roots)} explicit mods missing'
+        if graph.unresolved: summary += f', {len(graph.unresolved)} required dependencies unavailable'
+        lines.append(summary)
+    return '\n'.join(lines)
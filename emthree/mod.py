@@ -1,58 +1,98 @@
-import logging, aiohttp
-from emthree.api import ModrinthAPI
+import logging
+from emthree.versions import VersionStatus, VersionIndex, Version, ModFile
 from pathlib import Path
-from datetime import datetime
+from typing import TYPE_CHECKING
+# the API client pulls in aiohttp, which commands that stay offline never need
+if TYPE_CHECKING: from emthree.api import ModrinthAPI
 
 logger = logging.getLogger(__name__)
 
-class VersionStatus:
-    LATEST_RELEASE = 10 # latest mod version is release, and is for the target game version
-    LATEST_NONRELEASE_W_RELEASE = 11 # newer alpha/beta is available for the target game verison as well as a (likely) more stable release
-    LATEST_NONRELEASE_ONLY = 12 # latest mod version is alpha/beta for the target game version
-    LEGACY_RELEASE = 20 # latest mod version is release, but isn't for the target game version
-    LEGACY_NONRELEASE_W_RELEASE = 21 # newer alpha/beta is available as well as a (likely) more stable release, but not for the target game version
-    LEGACY_NONRELEASE_ONLY = 22 # latest mod version is alpha/beta, but isn't for the target game version
-    UNAVAILABLE = 30 # no versions available for your mod loader
-    MANUAL = 40 # version id manually set
-
 class Mod():
-    def __init__(self, api: ModrinthAPI, query: str, game_version: str, is_slug: bool, version_id:str = None):
+    # large packs resolve hundreds of these, so the attributes are fixed
+    __slots__ = ('API', 'query', 'slug', 'project_id', 'game_version', 'loader', 'manual_version_id', 'version_status',
+                 '_version_id', '_version_alt_id', 'dependencies', 'pending', '_using_alt_ver', '_selected', 'populated', 'installed', 'path', 'shared_loaders')
+
+    def __init__(self, api: 'ModrinthAPI', query: str, game_version: str, is_slug: bool, version_id:str = None, loader: str = "fabric", shared_loaders: list[str] = None):
         # allow passing an API instance for connection pooling. Otherwise, instantiate internally
         self.API = api
         self.query = query
         self.slug: str = query if is_slug else None
         self.project_id: str = query if not is_slug else None
         self.game_version: str = game_version
+        self.loader: str = loader
+        # when set, versions are looked up in a list fetched once for all of these loaders and every game version,
+        # which mods for other targets of the same run share
+        self.shared_loaders: list[str] = shared_loaders
         self.manual_version_id: str = version_id
-        self.version_status: int
-        self.version = None
-        self.version_alt = None
+        self.version_status: int = None
+        # version objects live in the API's shared version store, the mod only keeps their ids
+        self._version_id: str = None
+        self._version_alt_id: str = None
+        self.dependencies: list[dict] = []
+        self.pending: list[str] = [] # questions the version policy left for the user, see VersionPolicy
         self._using_alt_ver = False
-        self.poupulated = False
+        self._selected = False
+        self.populated = False
         self.installed = False
         self.path: Path = None
+
+    @property
+    def version(self) -> Version:
+        return self.API.versions.get(self._version_id)
+
+    @version.setter
+    def version(self, version: Version):
+        self._version_id = self.API.versions.add(version).id if version else None
+
+    @property
+    def version_alt(self) -> Version:
+        return self.API.versions.get(self._version_alt_id)
+
+    @version_alt.setter
+    def version_alt(self, version: Version):
+        self._version_alt_id = self.API.versions.add(version).id if version else None
+
+    @property
+    def selected_version(self) -> Version:
+        return self.version_alt if self._using_alt_ver else self.version
     
     async def populate_data(self):
-        if self.slug == None:
-            try:
-                self.slug = await self.API.get_slug_from_id(self.query)
-            except aiohttp.ClientResponseError as e:
-                logger.warning(f'{self.query} is invalid. Error: {e}')
-                raise e
-        self.data = await self.API.get_async(f'project/{self.slug}')
-        if self.project_id == None: self.project_id = self.data['id']
+        # the bulk projects endpoint accepts both slugs and ids, so there's no need to resolve the slug first
+        # only the ids are kept, the project document itself isn't needed after this
+        project = await self.API.get_project(self.query)
+        if project == None:
+            if self.API.offline: logger.warning(f'{self.query} is not cached, and emthree is running offline.')
+            else: logger.warning(f'{self.query} is invalid. No such project exists on Modrinth.')
+            raise LookupError(self.query)
+        self.slug = project['slug']
+        self.project_id = project['id']
         if not self.manual_version_id:
             # automatically search matching version
             await self._get_versions()
         else:
             # use manually specified version id (for retrieving dependencies)
             self.version_status = VersionStatus.MANUAL
-            self.version = await self.API.get_async(f'version/{self.manual_version_id}')
+            self.version = await self.API.get_version(self.manual_version_id)
+            if not self.version:
+                # the pinned version was deleted, so the mod goes into the graph's unresolved dependencies
+                logger.warning(f'{self.slug} {self.manual_version_id} no longer exists on Modrinth.')
+                raise LookupError(self.manual_version_id)
         self._selected = False if self.version_status in (VersionStatus.LATEST_NONRELEASE_W_RELEASE, VersionStatus.LEGACY_NONRELEASE_W_RELEASE) else True
-        if self._selected: self.dependencies = await self._fetch_dependencies()
+        if self._selected and self.version_status != VersionStatus.UNAVAILABLE: self.dependencies = self._read_dependencies()
         self.populated = True
         return self
     
+    async def populate_locked(self, slug: str):
+        # load the version pinned in the modlist. returns None if it no longer exists
+        self.slug = slug
+        self.version_status = VersionStatus.MANUAL
+        self.version = await self.API.get_version(self.manual_version_id)
+        if not self.version: return
+        self._selected = True
+        self.dependencies = self._read_dependencies()
+        self.populated = True
+        return self
+
     async def use_alt(self, use):
         if not self.version_status in (VersionStatus.LATEST_NONRELEASE_W_RELEASE, VersionStatus.LEGACY_NONRELEASE_W_RELEASE):
             logger.info(f'use_alt() was called on {self.slug}, but this mod has no alt versions. Ignoring.')
@@ -60,160 +100,56 @@ class Mod():
         else:
             self._using_alt_ver = True if use else False
             self._selected = True
-            self.dependencies = await self._fetch_dependencies()
+            self.dependencies = self._read_dependencies()
     
     async def _get_versions(self):
-        # fetch_versions sorts versions by release date, so next() should return the latest matching version
-        all_versions = await self.API.fetch_versions(self.slug)
-
-        # find compatible versions
-        target_versions = list(filter(
-            lambda v: ("fabric" in v['loaders']) and (self.game_version in v['game_versions']),
-            all_versions
-        ))
-
-        if target_versions:
-            # the mod has versions supporting the game version
-            # latest release
-            release_version_latest = next(
-                    (v
-                    for v in target_versions
-                    if v['version_type'] == "release"), None
-                )
-            # latest alpha/beta
-            nonrelease_version_latest = next(
-                    (v
-                    for v in all_versions
-                    if v['version_type'] != "release"), None
-                )
-            if not nonrelease_version_latest and not release_version_latest:
-                logger.error(f"Encountered a problem finding mod versions for {self.slug}.")
-                raise Exception("Program should have found mod versions for the game version, but it is empty.")
-            elif not nonrelease_version_latest:
-                # mod only has "release" version for game version
-                status = VersionStatus.LATEST_RELEASE
-                version = release_version_latest
-                version_alt = None
-            elif not release_version_latest:
-                # mod only has alpha/beta version for game version
-                status = VersionStatus.LATEST_NONRELEASE_ONLY
-                version = nonrelease_version_latest
-                version_alt = None
-            else:
-                release_timestamp = datetime.fromisoformat(release_version_latest['date_published'])
-                nonrelease_timestamp = datetime.fromisoformat(nonrelease_version_latest['date_published'])
-                if release_timestamp > nonrelease_timestamp:
-                    # the latest version is "release"
-                    status = VersionStatus.LATEST_RELEASE
-                    version = release_version_latest
-                    version_alt = None
-                else:
-                    # the alpha/beta bleeding edge version exists, but a release also exists.
-                    # user must pick.
-                    status = VersionStatus.LATEST_NONRELEASE_W_RELEASE
-                    version = release_version_latest
-                    version_alt = nonrelease_version_latest
+        if self.shared_loaders:
+            all_versions = await self.API.fetch_versions(self.slug, loaders=self.shared_loaders)
         else:
-            # the mod does not support the current version of the game explicitly. it may still support it implicitly
-            logger.warning(f'No versions of {self.slug} found for {self.game_version}')
-            # latest "release" version
-            target_version_release = next(
-                (v
-                for v in all_versions
-                if ("fabric" in v['loaders']) and (v['version_type'] == "release")), None
-            )
-            # latest alpha/beta version
-            target_version_nonrelease = next(
-                (v
-                for v in all_versions
-                if ("fabric" in v['loaders']) and (v['version_type'] != "release")), None
-            )
-            
-            if not target_version_release and not target_version_nonrelease:
-                # the mod has zero versions available for fabric
-                logger.warning(f"Could not a find compatible version of {self.slug} for fabric. Skipping")
-                
-                status = VersionStatus.UNAVAILABLE
-                version = None
-                version_alt = None
-                
-            elif not target_version_release and target_version_nonrelease:
-                # there are only alpha/beta versions available on previous game versions
-                status = VersionStatus.LEGACY_NONRELEASE_ONLY
-                version = target_version_nonrelease
-                version_alt = None
-            elif target_version_release and not target_version_nonrelease:
-                # there are only release versions available on previous game versions
-                status = VersionStatus.LEGACY_RELEASE
-                version = target_version_release
-                version_alt = None
-            else:
-                release_timestamp = datetime.fromisoformat(target_version_release['date_published'])
-                nonrelease_timestamp = datetime.fromisoformat(target_version_nonrelease['date_published'])
-                if release_timestamp > nonrelease_timestamp:
-                    # the latest release version available is newer than the latest alpha/beta available
-                    status = VersionStatus.LEGACY_RELEASE
-                    version = target_version_release
-                    version_alt = None
-                else:
-                    # the latest compatible version is in alpha/beta while an older release is also available
-                    # user must choose which to use
-                    status = VersionStatus.LEGACY_NONRELEASE_W_RELEASE
-                    version = target_version_release
-                    version_alt = target_version_nonrelease
-        self.version_status = status
-        self.version = version
-        self.version_alt = version_alt
+            # let the API filter by loader and game version, which is all most mods need
+            all_versions = await self.API.fetch_versions(self.slug, loaders=[self.loader], game_versions=[self.game_version])
+            if not all_versions:
+                # the mod does not support the current version of the game explicitly. it may still support it implicitly
+                logger.warning(f'No versions of {self.slug} found for {self.game_version}')
+                all_versions = await self.API.fetch_versions(self.slug, loaders=[self.loader])
+        self.version_status, self.version, self.version_alt = VersionIndex(all_versions).select(self.loader, self.game_version)
+        if self.version_status == VersionStatus.UNAVAILABLE:
+            logger.warning(f"Could not a find compatible version of {self.slug} for {self.loader}. Skipping")
     
-    async def _fetch_dependencies(self):
-        version = self.version_alt if self._using_alt_ver else self.version
-        try:
-            return await self.API.check_dependencies(version['id'])
-        except TypeError as e:
-            print(e)
-            print(version)
+    def _read_dependencies(self) -> list[dict]:
+        version = self.selected_version
+        if not version:
             logger.fatal(f'{self.slug} has no version data, code {self.version_status}')
+            return []
+        return self.API.versions.dependencies(version.id)
     
-    def get_dependencies(self) -> list['Mod']:
-        res = []
-        for d in self.dependencies:
-            res.append(Mod(self.API, d['project_id'], self.game_version, is_slug=False, version_id = d['version_id']))
-        return res
+    @property
+    def primary_file(self) -> ModFile:
+        version = self.selected_version
+        if not version:
+            logger.fatal(f'{self.slug} has no version data, code {self.version_status}')
+            return None
+        if not version.file: logger.error(f"{self.slug} {version.name} has no files")
+        return version.file
 
-    async def install(self, install_dir: Path):
-        version = self.version_alt if self._using_alt_ver else self.version
-        if not version: logger.fatal(f'{self.slug} has no version data, code {self.version_status}')
-        try:
-            file_to_get = next(f for f in version['files'] if f['primary'] == True)
-        except StopIteration:
-            logger.error(f"{self.slug} {version['name']} has no primary file, proceeding with first file in list")
-            file_to_get = version['files'][0]
-        mod_location = await self.API.download(file_to_get, install_dir)
+    async def install(self, install_dir: Path, progress = None):
+        mod_location = await self.API.download(self.primary_file, install_dir, progress)
+        # nothing comes back when the jar couldn't be fetched, e.g. while running offline
         self.path = mod_location
-        self.installed = True
+        self.installed = mod_location is not None
         return mod_location
         
 
-    def locate_file(self):
-        if self.path.is_file():
-            return self.path
-        elif self.installed == False:
-            return None
-        else:
-            self.installed = False
-            logger.error(f"Could not locate .jar file for {self.slug}")
-    
-    def update(self):
-        pass
-
     def create_dict(self) -> dict:
-        if self._selected:
+        if self._selected and self.selected_version:
+            primary_file = self.primary_file
             return {
                 "name": self.slug,
                 "project_id": self.project_id,
-                "version": self.version_alt['name'] if self._using_alt_ver else self.version['name'],
-                "version_id": self.version_alt['id'] if self._using_alt_ver else self.version['id'],
+                "version": self.selected_version.name,
+                "version_id": self.selected_version.id,
                 "file": self.path.name if self.installed else "NOT_INSTALLED",
-                "dependencies": self.dependencies if self.dependencies else []
+                "dependencies": self.dependencies if self.dependencies else [],
+                "download": primary_file.to_json()
             }
         pass
\ No newline at end of file
@@ -0,0 +1,115 @@
+import json, logging, os, shutil, zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, PurePosixPath
+from emthree.versions import ModFile
+
+logger = logging.getLogger(__name__)
+
+# Modrinth's modpack format: a zip with modrinth.index.json listing every file by URL and hash,
+# plus an overrides folder copied over the instance as is
+
+INDEX = 'modrinth.index.json'
+OVERRIDES = ('overrides/', 'client-overrides/')
+LOADER_IDS = {'fabric': 'fabric-loader', 'quilt': 'quilt-loader', 'forge': 'forge', 'neoforge': 'neoforge'}
+# already compressed, so deflating them again only costs time
+STORED = ('.jar', '.zip', '.png', '.jpg', '.ogg')
+
+class PackError(Exception):
+    pass
+
+def build_index(modlist: list[dict], name: str, version: str, game_version: str, loader: str = 'fabric', loader_version: str = None) -> dict:
+    # everything comes from the mod list, so nothing is downloaded or hashed again
+    files = []
+    for entry in modlist:
+        download = entry.get('download') or {}
+        hashes = download.get('hashes') or {}
+        if not hashes.get('sha1') or not hashes.get('sha512'):
+            logger.warning(f"{entry['name']} has no file information in the mod list. Run emthree init to record it. Skipping")
+            continue
+        files.append({
+            'path': f"mods/{download['filename']}",
+            'hashes': {'sha1': hashes['sha1'], 'sha512': hashes['sha512']},
+            'env': {'client': 'required', 'server': 'required'},
+            'downloads': [download['url']],
+            'fileSize': download['size'],
+        })
+    dependencies = {'minecraft': game_version}
+    if loader_version: dependencies[LOADER_IDS.get(loader, loader)] = loader_version
+    else: logger.warning(f'No {loader} version given, launchers may not know which one to install.')
+    return {'formatVersion': 1, 'game': 'minecraft', 'versionId': version, 'name': name, 'files': files, 'dependencies': dependencies}
+
+def _override_files(paths: list[Path]) -> list[tuple[Path, str]]:
+    # (file, name in the archive). a folder keeps its own name, so config/ ends up in overrides/config/
+    found = []
+    for path in map(Path, paths):
+        if path.is_file():
+            found.append((path, f'overrides/{path.name}'))
+            continue
+        for root, _, names in os.walk(path):
+            for name in sorted(names):
+                file = Path(root) / name
+                found.append((file, f'overrides/{PurePosixPath(path.name, file.relative_to(path).as_posix())}'))
+    return found
+
+def write_pack(pack_path: Path, index: dict, overrides: list[Path] = (), workers: int = 8) -> int:
+    # override files are read by a thread pool a few files ahead of the writer, so reading and compressing
+    # overlap while only a bounded number of files is held in memory. returns the number of override files
+    files = _override_files(overrides)
+    pack_path = Path(pack_path)
+    tmp = pack_path.with_name(pack_path.name + '.part')
+    with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_DEFLATED) as archive, ThreadPoolExecutor(workers) as pool:
+        archive.writestr(INDEX, json.dumps(index, indent=1))
+        pending = deque()
+        def write_next():
+            name, read = pending.popleft()
+            compression = zipfile.ZIP_STORED if name.endswith(STORED) else zipfile.ZIP_DEFLATED
+            archive.writestr(name, read.result(), compress_type=compression)
+        for path, name in files:
+            pending.append((name, pool.submit(path.read_bytes)))
+            if len(pending) >= workers * 2: write_next()
+        while pending: write_next()
+    os.replace(tmp, pack_path)
+    return len(files)
+
+def read_index(archive: zipfile.ZipFile) -> dict:
+    try:
+        with archive.open(INDEX) as f:
+            index = json.load(f)
+    except KeyError:
+        raise PackError(f'{INDEX} is missing, this is not a Modrinth modpack')
+    if index.get('game') != 'minecraft': raise PackError(f"This modpack is for {index.get('game')}, not Minecraft")
+    return index
+
+def target_path(mod_path: Path, relative: str) -> Path:
+    # paths in a pack are relative to the instance folder, which holds the mods folder. paths that would
+    # end up outside of it are rejected, as the format requires
+    parts = PurePosixPath(relative).parts
+    if not parts or PurePosixPath(relative).is_absolute() or '..' in parts or ':' in parts[0]:
+        raise PackError(f'Refusing to write outside the instance folder: {relative}')
+    if parts[0] == 'mods': return Path(mod_path).joinpath(*parts[1:])
+    return Path(mod_path).parent.joinpath(*parts)
+
+def pack_files(index: dict, mod_path: Path) -> list[tuple[ModFile, Path]]:
+    # (file, directory to download it to) for every file a client needs
+    files = []
+    for f in index.get('files', []):
+        if f.get('env', {}).get('client') == 'unsupported': continue
+        path = target_path(mod_path, f['path'])
+        hashes = f.get('hashes') or {}
+        # the downloads are mirrors of the same file, the first one is used
+        files.append((ModFile(path.name, f['downloads'][0], f.get('fileSize') or 0, hashes.get('sha1'), hashes.get('sha512')), path.parent))
+    return files
+
+def extract_overrides(archive: zipfile.ZipFile, mod_path: Path) -> int:
+    # copies the overrides over the instance, one entry at a time. returns the number of files written
+    count = 0
+    for member in archive.infolist():
+        prefix = next((p for p in OVERRIDES if member.filename.startswith(p)), None)
+        if prefix is None or member.is_dir(): continue
+        path = target_path(mod_path, member.filename.removeprefix(prefix))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with archive.open(member) as src, open(path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        count += 1
+    return count
@@ -0,0 +1,60 @@
+import logging
+from emthree.mod import Mod, VersionStatus
+
+logger = logging.getLogger(__name__)
+
+LEGACY = (VersionStatus.LEGACY_NONRELEASE_ONLY, VersionStatus.LEGACY_RELEASE, VersionStatus.LEGACY_NONRELEASE_W_RELEASE)
+NONRELEASE_ONLY = (VersionStatus.LATEST_NONRELEASE_ONLY, VersionStatus.LEGACY_NONRELEASE_ONLY)
+W_RELEASE = (VersionStatus.LATEST_NONRELEASE_W_RELEASE, VersionStatus.LEGACY_NONRELEASE_W_RELEASE)
+
+class PolicyError(Exception):
+    pass
+
+class VersionPolicy():
+    # decides which version of a mod to use without stopping to ask. anything the policy leaves to the
+    # user is recorded in mod.pending and asked about in one batch once everything else is resolved
+    PREFER = ('release', 'latest', 'ask', 'fail') # when a newer alpha/beta exists alongside a release
+    LEGACY = ('allow', 'deny', 'ask', 'fail') # when a mod doesn't support the target game version
+
+    def __init__(self, prefer: str = 'ask', legacy: str = 'ask', allow_beta: bool = True, allow_legacy: list[str] = None):
+        if prefer not in self.PREFER: raise ValueError(f'prefer must be one of {", ".join(self.PREFER)}')
+        if legacy not in self.LEGACY: raise ValueError(f'legacy must be one of {", ".join(self.LEGACY)}')
+        self.prefer = prefer
+        self.legacy = legacy
+        self.allow_beta = allow_beta
+        # slugs that may always use versions made for other game versions
+        self.allow_legacy = set(allow_legacy or ())
+
+    @classmethod
+    def from_config(cls, config: dict, args = None) -> 'VersionPolicy':
+        # command line flags take precedence over the "policy" section of the config
+        options = dict(config['emthree'].get('policy', {}))
+        if args is not None:
+            if getattr(args, 'prefer', None): options['prefer'] = args.prefer
+            if getattr(args, 'legacy', None): options['legacy'] = args.legacy
+            if getattr(args, 'no_beta', False): options['allow_beta'] = False
+            if getattr(args, 'allow_legacy', None):
+                options['allow_legacy'] = list(options.get('allow_legacy', [])) + args.allow_legacy
+        return cls(**options)
+
+    def setting(self, question: str) -> str:
+        return self.legacy if question == 'legacy' else self.prefer
+
+    async def apply(self, mod: Mod) -> bool:
+        # returns False if the mod should be skipped
+        status = mod.version_status
+        if status in LEGACY:
+            logger.warning(f"{mod.slug} doesn't explicitly support {mod.game_version}. Please check if it is maintained at https://modrinth.com/mod/{mod.slug}")
+            legacy = 'allow' if mod.slug in self.allow_legacy else self.legacy
+            if legacy == 'deny':
+                logger.info(f'Skipping {mod.slug}, versions for other game versions are not allowed.')
+                return False
+            if legacy in ('ask', 'fail'): mod.pending.append('legacy')
+        if status in NONRELEASE_ONLY and not self.allow_beta:
+            logger.info(f'Skipping {mod.slug}, it has no release versions and alpha/beta versions are not allowed.')
+            return False
+        if status in W_RELEASE:
+            if not self.allow_beta or self.prefer == 'release': await mod.use_alt(False)
+            elif self.prefer == 'latest': await mod.use_alt(True)
+            else: mod.pending.append('alt')
+        return True
@@ -0,0 +1,72 @@
+import asyncio, time, logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+class RateLimiter():
+    # sliding window limiter. callers await acquire() before each request, so running out of budget
+    # only suspends the coroutines that need a slot instead of the whole event loop.
+    def __init__(self, name: str, max_calls: int, period: float = 60.0):
+        self.name = name
+        self.max_calls = max_calls
+        self.period = period
+        self._calls = deque()
+        self._lock = asyncio.Lock()
+        # budget as last reported by the server, which takes precedence over the local count
+        self._remaining: int = None
+        self._reset_at: float = 0.0
+        self._blocked_until: float = 0.0
+
+    async def acquire(self) -> float:
+        # returns the number of seconds spent waiting for a slot
+        start = time.monotonic()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                if self._remaining is not None and now >= self._reset_at:
+                    self._remaining = None
+                if self._remaining is not None and self._remaining <= 0:
+                    logger.info(f'{self.name}: rate limit reached, waiting {round(self._reset_at - now, 1)} secs')
+                    await asyncio.sleep(self._reset_at - now)
+                    continue
+                while self._calls and now - self._calls[0] >= self.period:
+                    self._calls.popleft()
+                if len(self._calls) >= self.max_calls:
+                    delay = self.period - (now - self._calls[0])
+                    logger.info(f'{self.name}: rate limit reached, waiting {round(delay, 1)} secs')
+                    await asyncio.sleep(delay)
+                    continue
+                self._calls.append(now)
+                if self._remaining is not None: self._remaining -= 1
+                return time.monotonic() - start
+
+    def update(self, headers):
+        # X-Ratelimit-Reset is the number of seconds until the window resets
+        try:
+            limit = headers.get('X-Ratelimit-Limit')
+            remaining = headers.get('X-Ratelimit-Remaining')
+            reset = headers.get('X-Ratelimit-Reset')
+            if limit is not None: self.max_calls = int(limit)
+            if remaining is not None and reset is not None:
+                self._remaining = int(remaining)
+                self._reset_at = time.monotonic() + float(reset)
+        except ValueError:
+            logger.debug(f'{self.name}: ignoring malformed rate limit headers')
+
+    def backoff(self, headers) -> float:
+        # called on HTTP 429. blocks every caller until the server says the window has reset
+        delay = None
+        for key in ('Retry-After', 'X-Ratelimit-Reset'):
+            try:
+                delay = float(headers[key])
+                break
+            except (KeyError, ValueError):
+                continue
+        if delay is None: delay = self.period
+        self._remaining = 0
+        self._reset_at = self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+        logger.warning(f'{self.name}: received HTTP 429, backing off for {round(delay, 1)} secs')
+        return delay
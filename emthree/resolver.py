@@ -0,0 +1,114 @@
+import asyncio, logging
+from emthree.mod import Mod
+from emthree.policy import VersionPolicy
+from emthree.utils import get_mod, ask_pending
+from typing import TYPE_CHECKING
+if TYPE_CHECKING: from emthree.api import ModrinthAPI
+
+logger = logging.getLogger(__name__)
+
+class ResolvedGraph():
+    def __init__(self):
+        self.mods: dict[str, Mod] = {} # project_id -> Mod
+        self.roots: list[str] = [] # project ids of the mods that were asked for explicitly
+        self.edges: dict[str, set[str]] = {} # project_id -> project ids of its required dependencies
+        self.pending: list[Mod] = [] # mods waiting for the user to decide on their version
+
+    @property
+    def root_mods(self) -> list[Mod]:
+        return [self.mods[i] for i in self.roots]
+
+    @property
+    def dependencies(self) -> list[Mod]:
+        roots = set(self.roots)
+        return [m for i, m in self.mods.items() if i not in roots]
+
+    @property
+    def all_mods(self) -> list[Mod]:
+        return list(self.mods.values())
+
+    def discard(self, project_id: str):
+        self.mods.pop(project_id, None)
+        self.edges.pop(project_id, None)
+        if project_id in self.roots: self.roots.remove(project_id)
+
+    @property
+    def unresolved(self) -> set[str]:
+        # dependencies that were required but could not be loaded
+        return {d for deps in self.edges.values() for d in deps if d not in self.mods}
+
+class DependencyResolver():
+    # walks the dependency graph concurrently. every project is fetched at most once, no matter
+    # how many mods depend on it or how many of them discover it at the same time
+    def __init__(self, api: 'ModrinthAPI', game_version: str, known: set[str] = None, policy: VersionPolicy = None, loader: str = "fabric", shared_loaders: list[str] = None):
+        self.API = api
+        self.game_version = game_version
+        self.loader = loader
+        self.shared_loaders = shared_loaders # see Mod.shared_loaders
+        self.policy = policy or VersionPolicy()
+        # project ids that are already installed, which are recorded as edges but never fetched
+        self.known: set[str] = set(known) if known else set()
+        self.graph = ResolvedGraph()
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    async def resolve(self, queries: list[str]) -> ResolvedGraph:
+        found = await asyncio.gather(*[get_mod(self.API, q, self.game_version, is_slug=True, policy=self.policy, loader=self.loader, shared_loaders=self.shared_loaders) for q in queries])
+        roots = []
+        for mod in filter(None, found):
+            if mod.project_id in self.graph.mods: continue
+            self._claim(mod)
+            self.graph.roots.append(mod.project_id)
+            roots.append(mod)
+        await self.expand(roots)
+        return self.graph
+
+    async def expand(self, mods: list[Mod]):
+        # (re)visit mods whose dependencies are known, e.g. after the user picked an alternative version
+        await asyncio.gather(*[self._visit(m) for m in mods])
+
+    async def settle(self, assume_yes: bool = False) -> ResolvedGraph:
+        # ask the user about every pending mod in one go, then resolve the dependencies of the ones they kept.
+        # those can bring up new questions, so repeat until nothing is left
+        while self.graph.pending:
+            pending, self.graph.pending = self.graph.pending, []
+            keep = await ask_pending(pending, self.policy, assume_yes)
+            for mod in pending:
+                if mod not in keep: self.graph.discard(mod.project_id)
+            await self.expand(keep)
+        return self.graph
+
+    def _claim(self, mod: Mod):
+        fut = asyncio.get_running_loop().create_future()
+        fut.set_result(mod)
+        self._inflight[mod.project_id] = fut
+        self.graph.mods[mod.project_id] = mod
+
+    async def _visit(self, mod: Mod):
+        if mod.pending:
+            # dependencies depend on which version the user picks
+            self.graph.pending.append(mod)
+            return
+        edges = self.graph.edges.setdefault(mod.project_id, set())
+        spawned = []
+        for d in mod.dependencies:
+            project_id = d['project_id']
+            if project_id is None:
+                # some dependencies are only declared by version id
+                version = await self.API.get_version(d['version_id'])
+                if not version: continue
+                project_id = version.project_id
+            edges.add(project_id)
+            if project_id in self.known or project_id in self._inflight: continue
+            task = asyncio.ensure_future(self._fetch(project_id, d['version_id']))
+            self._inflight[project_id] = task
+            spawned.append(task)
+        # only wait on the fetches started here. waiting on someone else's could deadlock on cycles
+        if spawned: await asyncio.gather(*spawned)
+
+    async def _fetch(self, project_id: str, version_id: str) -> Mod:
+        mod = await get_mod(self.API, project_id, self.game_version, is_slug=False, version_id=version_id, policy=self.policy, loader=self.loader, shared_loaders=self.shared_loaders)
+        if not mod: return
+        self.graph.mods[project_id] = mod
+        logger.info(f'Found and loaded dependency {mod.slug}')
+        await self._visit(mod)
+        return mod
@@ -0,0 +1,118 @@
+import hashlib, json, logging, mmap, os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+class Jar():
+    def __init__(self, path: Path, size: int, sha1: str, sha512: str):
+        self.path = Path(path)
+        self.name = self.path.name
+        self.size = size
+        self.sha1 = sha1
+        self.sha512 = sha512
+
+def hash_jar(path: Path, chunk_size: int = 4 * 1024 * 1024) -> tuple[str, str]:
+    # hashes the file with both algorithms in a single pass over a memory mapped view.
+    # hashlib releases the GIL on large buffers, so this scales across threads
+    sha1 = hashlib.sha1()
+    sha512 = hashlib.sha512()
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return sha1.hexdigest(), sha512.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            view = memoryview(m)
+            try:
+                for i in range(0, len(view), chunk_size):
+                    sha1.update(view[i:i + chunk_size])
+                    sha512.update(view[i:i + chunk_size])
+            finally:
+                view.release()
+    return sha1.hexdigest(), sha512.hexdigest()
+
+class HashIndex():
+    # remembers the hashes of every jar emthree has seen, so files that haven't changed are never hashed again.
+    # a file counts as unchanged while its inode, size and modification time stay the same
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._entries: dict[str, list] = {}
+        self._dirty = False
+        try:
+            with self.path.open('r') as f:
+                self._entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except json.JSONDecodeError:
+            logger.warning(f'{self.path} is corrupted, rebuilding it.')
+
+    def get(self, path: str, st: os.stat_result) -> tuple[str, str]:
+        entry = self._entries.get(path)
+        if entry and entry[:3] == [st.st_ino, st.st_size, st.st_mtime_ns]:
+            return entry[3], entry[4]
+        return None
+
+    def put(self, path: str, st: os.stat_result, sha1: str, sha512: str):
+        self._entries[path] = [st.st_ino, st.st_size, st.st_mtime_ns, sha1, sha512]
+        self._dirty = True
+
+    def save(self):
+        if not self._dirty: return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        with tmp.open('w') as f:
+            json.dump(self._entries, f, separators=(',', ':'))
+        os.replace(tmp, self.path)
+        self._dirty = False
+
+def scan_mods(mod_path: Path, index: HashIndex = None, workers: int = None) -> list[Jar]:
+    # every jar directly in mod_path, hashed in a thread pool. unchanged files are served from the index
+    with os.scandir(mod_path) as it:
+        entries = [e for e in it if e.name.endswith('.jar') and e.is_file()]
+    jars = []
+    to_hash = []
+    for e in entries:
+        st = e.stat()
+        cached = index.get(e.path, st) if index else None
+        if cached: jars.append(Jar(e.path, st.st_size, *cached))
+        else: to_hash.append((e.path, st))
+    if to_hash:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for (path, st), digests in zip(to_hash, pool.map(hash_jar, [p for p, _ in to_hash])):
+                jars.append(Jar(path, st.st_size, *digests))
+                if index: index.put(path, st, *digests)
+        logger.debug(f'hashed {len(to_hash)} of {len(entries)} jars')
+    if index: index.save()
+    return jars
+
+class ScanReport():
+    def __init__(self):
+        self.tracked: list[tuple[dict, Jar]] = [] # listed in the modlist and matching its hash
+        self.modified: list[tuple[dict, Jar]] = [] # listed in the modlist, but the file differs from the pinned one
+        self.missing: list[dict] = [] # listed in the modlist, but not on disk
+        self.untracked: list[Jar] = [] # on disk, but not in the modlist
+
+    @property
+    def installed(self) -> list[tuple[dict, Jar]]:
+        return self.tracked + self.modified
+
+def compare(modlist: list[dict], jars: list[Jar]) -> ScanReport:
+    report = ScanReport()
+    by_name = {j.name: j for j in jars}
+    by_hash = {j.sha512: j for j in jars}
+    for entry in modlist:
+        download = entry.get('download', {})
+        expected = download.get('hashes', {}).get('sha512')
+        name = entry['file'] if entry.get('file') and entry['file'] != 'NOT_INSTALLED' else download.get('filename')
+        jar = by_name.get(name)
+        if jar is None and expected:
+            # the jar may have been renamed
+            jar = by_hash.get(expected)
+        if jar is None:
+            report.missing.append(entry)
+            continue
+        by_name.pop(jar.name, None)
+        by_hash.pop(jar.sha512, None)
+        if expected and jar.sha512 != expected: report.modified.append((entry, jar))
+        else: report.tracked.append((entry, jar))
+    report.untracked = [j for j in jars if j.name in by_name]
+    return report
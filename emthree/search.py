@@ -0,0 +1,218 @@
+import json, logging, mmap, os, re, struct, time
+from collections import Counter
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# offline search over every project emthree has seen. the index is an inverted token index in a single
+# binary file that is memory mapped at query time, so a query only touches the pages it needs:
+#
+#   header
+#   doc table      n_docs x (offset, length) of each document's JSON
+#   documents
+#   term table     n_terms x (string offset, string length, postings offset, postings count), sorted by term
+#   term strings
+#   postings       (doc number, weight) pairs
+#
+# the sorted term table is binary searched for exact and prefix matches, and scanned for fuzzy ones
+
+MAGIC = b'EMSI'
+FORMAT = 1
+HEADER = struct.Struct('<4sIdIIQQQQ')
+DOC = struct.Struct('<QI')
+TERM = struct.Struct('<QHQI')
+POSTING = struct.Struct('<IH')
+
+LOADERS = {'fabric', 'quilt', 'forge', 'neoforge', 'liteloader', 'modloader', 'rift'}
+# how much a token counts depending on where it was found
+WEIGHTS = {'slug': 8, 'title': 6, 'categories': 2, 'description': 1}
+# how much a match counts depending on how the query term matched the token
+EXACT, PREFIX, FUZZY = 1.0, 0.6, 0.4
+
+_TOKEN = re.compile(r'[a-z0-9]+')
+
+def tokenize(text: str) -> list[str]:
+    return _TOKEN.findall(text.lower())
+
+def project_document(p: dict) -> dict:
+    # the fields of a project document, or of a search API hit, that the index needs
+    categories = list(p.get('categories') or []) + list(p.get('display_categories') or [])
+    loaders = set(p.get('loaders') or []) | {c for c in categories if c in LOADERS}
+    return {
+        'id': p.get('project_id') or p['id'],
+        'slug': p['slug'],
+        'title': p.get('title') or p['slug'],
+        'description': (p.get('description') or '')[:300],
+        'categories': sorted({c for c in categories if c not in LOADERS}),
+        'loaders': sorted(loaders),
+        'game_versions': list(p.get('game_versions') or p.get('versions') or []),
+        'downloads': p.get('downloads') or 0,
+    }
+
+def _doc_tokens(doc: dict) -> Counter:
+    weights = Counter()
+    # the slug is indexed whole as well, so a query for "fabric-api" matches it exactly
+    for token in [doc['slug'].lower()] + tokenize(doc['slug']):
+        weights[token] = max(weights[token], WEIGHTS['slug'])
+    for field in ('title', 'description'):
+        for token in tokenize(doc[field]):
+            weights[token] = max(weights[token], WEIGHTS[field])
+    for token in tokenize(' '.join(doc['categories'])):
+        weights[token] = max(weights[token], WEIGHTS['categories'])
+    return weights
+
+def write_index(path: Path, docs: list[dict], built_at: float):
+    postings: dict[bytes, list[tuple[int, int]]] = {}
+    for n, doc in enumerate(docs):
+        for token, weight in _doc_tokens(doc).items():
+            postings.setdefault(token.encode(), []).append((n, weight))
+    terms = sorted(postings)
+    encoded = [json.dumps(d, separators=(',', ':')).encode() for d in docs]
+
+    doc_table = HEADER.size
+    doc_data = doc_table + DOC.size * len(docs)
+    term_table = doc_data + sum(len(e) for e in encoded)
+    strings = term_table + TERM.size * len(terms)
+    posting_data = strings + sum(len(t) for t in terms)
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT, built_at, len(docs), len(terms), doc_table, term_table, strings, posting_data))
+        offset = doc_data
+        for e in encoded:
+            f.write(DOC.pack(offset, len(e)))
+            offset += len(e)
+        for e in encoded: f.write(e)
+        string_offset = strings
+        posting_offset = posting_data
+        for t in terms:
+            f.write(TERM.pack(string_offset, len(t), posting_offset, len(postings[t])))
+            string_offset += len(t)
+            posting_offset += POSTING.size * len(postings[t])
+        for t in terms: f.write(t)
+        for t in terms:
+            f.write(b''.join(POSTING.pack(n, w) for n, w in postings[t]))
+    os.replace(tmp, path)
+
+def _distance(a: str, b: str, limit: int) -> int:
+    # levenshtein distance, giving up as soon as it exceeds limit
+    if abs(len(a) - len(b)) > limit: return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit: return limit + 1
+        previous = current
+    return previous[-1]
+
+class SearchIndex():
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._file = open(self.path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, self.built_at, self.n_docs, self.n_terms, self._doc_table, self._term_table, _, _ = HEADER.unpack_from(self._map)
+        except (ValueError, struct.error):
+            self._file.close()
+            raise ValueError(f'{self.path} is not a search index')
+        if magic != MAGIC or version != FORMAT:
+            self.close()
+            raise ValueError(f'{self.path} is not a search index')
+
+    @classmethod
+    def open(cls, path: Path) -> 'SearchIndex':
+        # returns None if there is no usable index yet
+        try:
+            return cls(path)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def document(self, n: int) -> dict:
+        offset, length = DOC.unpack_from(self._map, self._doc_table + n * DOC.size)
+        return json.loads(self._map[offset:offset + length])
+
+    def documents(self) -> list[dict]:
+        return [self.document(n) for n in range(self.n_docs)]
+
+    def _term(self, i: int) -> bytes:
+        offset, length, _, _ = TERM.unpack_from(self._map, self._term_table + i * TERM.size)
+        return self._map[offset:offset + length]
+
+    def _postings(self, i: int):
+        _, _, offset, count = TERM.unpack_from(self._map, self._term_table + i * TERM.size)
+        return POSTING.iter_unpack(self._map[offset:offset + count * POSTING.size])
+
+    def _lower_bound(self, key: bytes) -> int:
+        lo, hi = 0, self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < key: lo = mid + 1
+            else: hi = mid
+        return lo
+
+    def _match(self, term: str) -> list[tuple[int, float]]:
+        # (term number, match quality). fuzzy matching only kicks in when nothing starts with the term
+        key = term.encode()
+        found = []
+        i = self._lower_bound(key)
+        while i < self.n_terms and self._term(i).startswith(key):
+            found.append((i, EXACT if self._term(i) == key else PREFIX))
+            i += 1
+        if found or len(term) < 3: return found
+        # typos rarely change the first letter, so only terms starting with it are compared
+        limit = 1 if len(term) <= 5 else 2
+        lo = self._lower_bound(key[:1])
+        hi = self._lower_bound(bytes([key[0] + 1])) if key[0] < 255 else self.n_terms
+        for i in range(lo, hi):
+            if _distance(term, self._term(i).decode(), limit) <= limit: found.append((i, FUZZY))
+        return found
+
+    def search(self, query: str, loader: str = None, game_version: str = None, limit: int = 10) -> list[dict]:
+        terms = tokenize(query)
+        if not terms: return []
+        scores = Counter()
+        matched = Counter()
+        for term in terms:
+            hits = {}
+            for i, quality in self._match(term):
+                for n, weight in self._postings(i):
+                    hits[n] = max(hits.get(n, 0), weight * quality)
+            for n, score in hits.items():
+                scores[n] += score
+                matched[n] += 1
+        # projects matching every term come first. if there are none, any match will do
+        candidates = [n for n in scores if matched[n] == len(terms)] or list(scores)
+        results = []
+        for n in candidates:
+            doc = self.document(n)
+            if loader and loader not in doc['loaders']: continue
+            if game_version and game_version not in doc['game_versions']: continue
+            results.append((scores[n], doc))
+        results.sort(key=lambda r: (r[0], r[1]['downloads']), reverse=True)
+        return [doc for _, doc in results[:limit]]
+
+    def suggest(self, name: str, limit: int = 3) -> list[str]:
+        # slugs that are close to a mod name that doesn't exist
+        return [d['slug'] for d in self.search(name, limit=limit) if d['slug'] != name.lower()]
+
+def update_index(path: Path, cache = None, seed: list[dict] = ()) -> SearchIndex:
+    # adds the project documents cached since the index was last built, and any search API hits, to the index
+    started = time.time()
+    existing = SearchIndex.open(path)
+    since = existing.built_at if existing else 0.0
+    new = [project_document(p) for p in (cache.documents('project/', since) if cache else [])]
+    new += [project_document(p) for p in seed]
+    if existing and not new: return existing
+    docs = {d['id']: d for d in existing.documents()} if existing else {}
+    if existing: existing.close()
+    for d in new: docs[d['id']] = d
+    write_index(path, list(docs.values()), started)
+    logger.debug(f'indexed {len(new)} projects, {len(docs)} in total')
+    return SearchIndex(path)
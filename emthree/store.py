@@ -0,0 +1,158 @@
+import json, logging, os, shutil, threading
+from pathlib import Path
+from emthree.hashing import hash_file
+
+logger = logging.getLogger(__name__)
+
+FICLONE = 0x40049409 # linux ioctl for copy-on-write clones (btrfs, xfs)
+
+def clone(src: Path, dst: Path) -> str:
+    # cheapest way to make dst hold the same content as src. returns how it was done
+    try:
+        os.link(src, dst)
+        return 'hardlink'
+    except OSError:
+        pass
+    try:
+        import fcntl
+        with open(src, 'rb') as s, open(dst, 'wb') as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        return 'reflink'
+    except (ImportError, OSError):
+        Path(dst).unlink(missing_ok=True)
+    shutil.copyfile(src, dst)
+    return 'copy'
+
+class JarStore():
+    # content addressable store of every jar emthree has installed, keyed by sha512 and shared by every profile.
+    # installs are hardlinks (or reflinks/copies where that isn't possible) into the store, and refs.json
+    # records where each jar was installed so gc knows which ones are still in use
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.blobs = self.root / 'blobs'
+        self.refs_file = self.root / 'refs.json'
+        self._refs: dict[str, list[str]] = None
+        # adopt and install record references from worker threads, so loading and changing them is serialized
+        self._lock = threading.Lock()
+        self._verified: set[str] = set() # blobs checked or added during this run
+
+    def _load(self) -> dict[str, list[str]]:
+        # callers hold the lock
+        if self._refs is None:
+            try:
+                with self.refs_file.open('r') as f:
+                    self._refs = json.load(f)
+            except FileNotFoundError:
+                self._refs = {}
+        return self._refs
+
+    @property
+    def refs(self) -> dict[str, list[str]]:
+        with self._lock:
+            return self._load()
+
+    def blob_path(self, sha512: str) -> Path:
+        return self.blobs / sha512[:2] / sha512[2:]
+
+    def has(self, sha512: str) -> bool:
+        return self.blob_path(sha512).is_file()
+
+    def verify(self, sha512: str, size: int = None) -> bool:
+        # whether the stored jar is still intact. blobs are hardlinked into mods folders, so a jar changed in place
+        # changes its blob too. a damaged blob is evicted, which makes the caller download the jar again
+        if sha512 in self._verified: return True
+        blob = self.blob_path(sha512)
+        try:
+            st = blob.stat()
+        except FileNotFoundError:
+            return False
+        if (not size or st.st_size == size) and hash_file(blob) == sha512:
+            # blobs from before they were made read-only
+            if st.st_mode & 0o222: blob.chmod(0o444)
+            with self._lock: self._verified.add(sha512)
+            return True
+        logger.warning(f'The stored copy of {sha512[:12]} was modified, evicting it from the store')
+        blob.unlink(missing_ok=True)
+        return False
+
+    def _ref(self, sha512: str, path: Path):
+        path = str(Path(path).absolute())
+        with self._lock:
+            paths = self._load().setdefault(sha512, [])
+            if path not in paths: paths.append(path)
+
+    def adopt(self, path: Path, sha512: str):
+        # add a verified jar that was just downloaded to path
+        blob = self.blob_path(sha512)
+        if not blob.is_file():
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            # adopt and install run in worker threads, so temporary names must not collide
+            tmp = blob.with_name(f'{blob.name}.{threading.get_ident()}.tmp')
+            tmp.unlink(missing_ok=True)
+            clone(path, tmp)
+            # read-only, so the jar can't be changed through any of the mods folders it is linked into
+            tmp.chmod(0o444)
+            os.replace(tmp, blob)
+        with self._lock: self._verified.add(sha512)
+        self._ref(sha512, path)
+
+    def install(self, sha512: str, path: Path) -> Path:
+        # put the stored jar at path. the rename makes it atomic, so path never holds a partial file.
+        # callers check the blob with verify first
+        tmp = Path(path).with_name(Path(path).name + '.part')
+        tmp.unlink(missing_ok=True)
+        method = clone(self.blob_path(sha512), tmp)
+        os.replace(tmp, path)
+        self._ref(sha512, path)
+        logger.debug(f'installed {Path(path).name} from the store ({method})')
+        return Path(path)
+
+    def moved(self, src: Path, dst: Path):
+        # keeps the references right when an installed jar is renamed, e.g. out of the update staging folder
+        src = str(Path(src).absolute())
+        with self._lock:
+            for paths in self._load().values():
+                if src in paths: paths[paths.index(src)] = str(Path(dst).absolute())
+
+    def save(self):
+        if self._refs is None: return
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.refs_file.with_name(self.refs_file.name + '.tmp')
+        with self._lock, tmp.open('w') as f:
+            json.dump(self._refs, f, indent=1)
+        os.replace(tmp, self.refs_file)
+
+    def _still_installed(self, blob: Path, path: str) -> bool:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return False
+        blob_st = blob.stat()
+        if st.st_ino == blob_st.st_ino and st.st_dev == blob_st.st_dev: return True
+        # copies and reflinks can't be told apart by inode. hash only when the size still matches
+        if st.st_size != blob_st.st_size: return False
+        return hash_file(path) == blob.parent.name + blob.name
+
+    def gc(self) -> tuple[int, int]:
+        # drops references to installs that were removed or replaced, then deletes jars nothing refers to.
+        # returns (jars removed, bytes freed)
+        removed = 0
+        freed = 0
+        if not self.blobs.is_dir(): return removed, freed
+        for prefix in self.blobs.iterdir():
+            for blob in prefix.iterdir():
+                sha512 = prefix.name + blob.name
+                live = [p for p in self.refs.get(sha512, []) if self._still_installed(blob, p)]
+                if live:
+                    self.refs[sha512] = live
+                    continue
+                self.refs.pop(sha512, None)
+                freed += blob.stat().st_size
+                blob.unlink()
+                removed += 1
+            if not any(prefix.iterdir()): prefix.rmdir()
+        # references to jars that are no longer in the store
+        for sha512 in [s for s in self.refs if not self.has(s)]:
+            del self.refs[sha512]
+        self.save()
+        return removed, freed
@@ -0,0 +1,191 @@
+import asyncio, json, logging, os
+from pathlib import Path
+from emthree.download import DownloadScheduler
+from emthree.cache import OfflineCacheMiss
+from emthree.hashing import pick_hash, hash_file
+from emthree.scanner import Jar, scan_mods, compare
+from emthree.store import JarStore, clone
+from emthree.versions import ModFile
+from typing import TYPE_CHECKING
+if TYPE_CHECKING: from emthree.api import ModrinthAPI
+
+logger = logging.getLogger(__name__)
+
+# applies one lockfile to many mods folders. the files every target needs are worked out first, each file
+# missing anywhere is downloaded once, and then every target is brought in line at the same time, copying
+# from the store or from a target that already has the file. each target keeps a state file listing the
+# jars sync put there, so only those are ever removed and unchanged jars don't have to be hashed again.
+# a target without a state file is scanned in full the first time, so older versions of the locked mods that
+# were already there are replaced instead of ending up next to the new ones
+
+STATE = '.emthree-sync.json'
+
+def file_key(f: ModFile) -> str:
+    return f.sha512 or f.sha1 or f.url
+
+def locked_files(modlist: list[dict]) -> list[ModFile]:
+    # the files recorded in the lockfile. None if any entry lacks them, e.g. a list written by an old version
+    if not all((m.get('download') or {}).get('hashes') for m in modlist): return None
+    return [ModFile.from_json(m['download']) for m in modlist]
+
+def read_targets(targets_file: Path) -> list[Path]:
+    # one folder per line, relative ones relative to the file. blank lines and # comments are skipped
+    targets_file = Path(targets_file)
+    targets = []
+    for line in targets_file.read_text().splitlines():
+        line = line.split('#', 1)[0].strip()
+        if line: targets.append(targets_file.parent / Path(line).expanduser())
+    return targets
+
+class TargetPlan():
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.state: dict[str, str] = {} # file name -> file key, as of the last sync
+        self.present: dict[str, Path] = {} # file key -> verified jar already in place
+        self.add: list[ModFile] = []
+        self.remove: list[str] = []
+        self.added = 0
+        self.removed = 0
+        self.missing: list[str] = []
+        self.unknown: list[Jar] = [] # jars found on first contact that the lockfile doesn't account for
+        self.unmanaged: list[str] = [] # of those, the ones that aren't a version of a locked project, left in place
+        self.error: str = None
+
+def read_state(path: Path) -> dict[str, str]:
+    try:
+        with (Path(path) / STATE).open('r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def plan_target(path: Path, files: list[ModFile]) -> TargetPlan:
+    # works out what has to change in one target. jars the last sync recorded are trusted if their size still
+    # matches, anything else with the right name is hashed
+    plan = TargetPlan(path)
+    try:
+        plan.path.mkdir(parents=True, exist_ok=True)
+        if not (plan.path / STATE).is_file(): return _plan_first_contact(plan, files)
+        plan.state = read_state(plan.path)
+        wanted = {f.filename: f for f in files}
+        for name, f in wanted.items():
+            file_path = plan.path / name
+            present = False
+            if file_path.is_file():
+                if plan.state.get(name) == file_key(f) and (not f.size or file_path.stat().st_size == f.size):
+                    present = True
+                else:
+                    algorithm, expected = pick_hash(f)
+                    present = expected is None or hash_file(file_path, algorithm) == expected
+            if present: plan.present[file_key(f)] = file_path
+            else: plan.add.append(f)
+        plan.remove = [name for name in plan.state if name not in wanted and (plan.path / name).is_file()]
+    except OSError as e:
+        plan.error = str(e)
+    return plan
+
+def _plan_first_contact(plan: TargetPlan, files: list[ModFile]) -> TargetPlan:
+    # sync has never been here, so every jar is hashed and matched against the lockfile
+    entries = [{'download': f.to_json()} for f in files]
+    by_entry = {id(e): f for e, f in zip(entries, files)}
+    report = compare(entries, scan_mods(plan.path))
+    for entry, jar in report.tracked:
+        f = by_entry[id(entry)]
+        if jar.name == f.filename:
+            plan.present[file_key(f)] = jar.path
+        else:
+            # the right jar under another name, installed again under the locked one
+            plan.add.append(f)
+            plan.remove.append(jar.name)
+    # a jar with the locked name but other contents is overwritten when the locked one is installed
+    plan.add += [by_entry[id(entry)] for entry, _ in report.modified]
+    plan.add += [by_entry[id(entry)] for entry in report.missing]
+    plan.unknown = report.untracked
+    return plan
+
+def apply_plan(plan: TargetPlan, files: list[ModFile], sources: dict[str, Path], store: JarStore = None) -> TargetPlan:
+    # installs every missing jar from the store or from another target's copy, then drops the stale ones
+    if plan.error: return plan
+    try:
+        for f in plan.add:
+            dst = plan.path / f.filename
+            source = sources.get(file_key(f))
+            if source == dst:
+                # downloaded straight into this target
+                plan.added += 1
+            elif store and f.sha512 and store.verify(f.sha512, f.size):
+                store.install(f.sha512, dst)
+                plan.added += 1
+            elif source:
+                tmp = dst.with_name(dst.name + '.part')
+                tmp.unlink(missing_ok=True)
+                clone(source, tmp)
+                os.replace(tmp, dst)
+                plan.added += 1
+            else: plan.missing.append(f.filename)
+        for name in plan.remove:
+            (plan.path / name).unlink(missing_ok=True)
+            plan.removed += 1
+        state = {f.filename: file_key(f) for f in files if f.filename not in plan.missing}
+        tmp = plan.path / (STATE + '.tmp')
+        with tmp.open('w') as f:
+            json.dump(state, f, indent=1)
+        os.replace(tmp, plan.path / STATE)
+    except OSError as e:
+        plan.error = str(e)
+    return plan
+
+async def _replace_unknown(api: 'ModrinthAPI', plans: list[TargetPlan], projects: set[str]):
+    # jars found on first contact that are another version of a locked project are removed, since the locked
+    # version is installed next to them. everything else is left alone and reported
+    jars = [j for p in plans for j in p.unknown]
+    if not jars: return
+    identified = {}
+    try:
+        identified = await api.identify_files(list({j.sha512 for j in jars}))
+    except OfflineCacheMiss:
+        logger.warning("Jars already in the targets can't be looked up while running offline, so they are left in place")
+    for plan in plans:
+        for jar in plan.unknown:
+            version = identified.get(jar.sha512)
+            if version and version.project_id in projects: plan.remove.append(jar.name)
+            else: plan.unmanaged.append(jar.name)
+
+async def sync_targets(api: 'ModrinthAPI', files: list[ModFile], targets: list[Path], concurrency: int = 8, projects: set[str] = ()) -> list[TargetPlan]:
+    plans = await asyncio.gather(*[asyncio.to_thread(plan_target, t, files) for t in targets])
+    await _replace_unknown(api, [p for p in plans if not p.error], set(projects))
+    # any verified copy can be the source for every other target
+    sources: dict[str, Path] = {}
+    for plan in plans: sources.update(plan.present)
+    stored = set()
+    if api.store:
+        # checked up front, so a damaged blob is downloaded again rather than copied into every target
+        needed = {f.sha512: f for p in plans if not p.error for f in p.add if f.sha512}
+        intact = await asyncio.gather(*[asyncio.to_thread(api.store.verify, h, f.size) for h, f in needed.items()])
+        stored = {h for h, ok in zip(needed, intact) if ok}
+    downloads: dict[str, tuple[ModFile, Path]] = {}
+    for plan in plans:
+        if plan.error: continue
+        for f in plan.add:
+            key = file_key(f)
+            if key in sources or key in downloads or f.sha512 in stored: continue
+            # into the first target that needs it, the others copy it from there
+            downloads[key] = (f, plan.path)
+    if downloads:
+        logger.info(f'Downloading {len(downloads)} jars missing from every target and the store')
+        scheduler = DownloadScheduler(targets[0], concurrency=concurrency)
+        fetched = set(await scheduler.run_files(api, list(downloads.values())))
+        for key, (f, directory) in downloads.items():
+            # a jar with the same name may already be there, so only files that were actually fetched count
+            if directory / f.filename in fetched: sources[key] = directory / f.filename
+    return await asyncio.gather(*[asyncio.to_thread(apply_plan, p, files, sources, api.store) for p in plans])
+
+def sync_report(plans: list[TargetPlan], total: int) -> str:
+    width = max([len(str(p.path)) for p in plans] + [6]) + 2
+    lines = [f'{"target":<{width}} {"added":>6} {"removed":>8} {"kept":>6}  result']
+    for p in plans:
+        if p.error: result = f'failed: {p.error}'
+        elif p.missing: result = f'{len(p.missing)} jars missing: {", ".join(p.missing)}'
+        else: result = 'ok'
+        if p.unmanaged and not p.error: result += f', {len(p.unmanaged)} jars not in the lockfile left in place: {", ".join(p.unmanaged)}'
+        lines.append(f'{str(p.path):<{width}} {p.added:>6} {p.removed:>8} {total - len(p.add):>6}  {result}')
+    return '\n'.join(lines)
@@ -0,0 +1,87 @@
+import json, logging, math, re, time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# ids in API paths are replaced so that requests for different projects are grouped under one endpoint
+_ID_SEGMENT = re.compile(r'^(project|version|version_file)/[^/]+')
+
+def endpoint_of(url: str, root: str = '') -> str:
+    path = url.removeprefix(root).split('?', 1)[0]
+    return _ID_SEGMENT.sub(r'\1/{id}', path)
+
+def percentile(values: list[float], p: float) -> float:
+    # nearest rank, which is exact for the small samples a single run produces
+    if not values: return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p * len(ordered)) - 1)]
+
+class Tracer():
+    # records one event per request, cache hit and store install. with a path, events are also written
+    # to it as JSON lines while the run is in progress, so a run that hangs can still be inspected
+    def __init__(self, path: Path = None):
+        self.path = Path(path) if path else None
+        self.events: list[dict] = []
+        self.counters: dict[str, int] = {} # things that happen to requests rather than being requests, e.g. hedging
+        self.start = time.perf_counter()
+        self._file = self.path.open('w') if self.path else None
+
+    def record(self, kind: str, endpoint: str, status: int = None, latency: float = 0.0, size: int = 0, cache: str = None, wait: float = 0.0, disk: float = 0.0, method: str = 'GET'):
+        # kind is api, cdn or store. latency is the time spent on the network, wait the time spent on the
+        # rate limiter before the request was sent, and disk the time spent writing and hashing files
+        event = {
+            't': round(time.perf_counter() - self.start - latency - wait - disk, 4),
+            'kind': kind,
+            'method': method,
+            'endpoint': endpoint,
+            'status': status,
+            'latency': round(latency, 4),
+            'bytes': size,
+            'cache': cache,
+            'wait': round(wait, 4),
+            'disk': round(disk, 4),
+        }
+        self.events.append(event)
+        if self._file: self._file.write(json.dumps(event) + '\n')
+
+    def count(self, name: str):
+        self.counters[name] = self.counters.get(name, 0) + 1
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def summary(self) -> list[dict]:
+        # one row per endpoint. percentiles are over the time each request or disk operation took, cache hits excluded
+        rows = {}
+        for e in self.events:
+            row = rows.setdefault((e['kind'], e['endpoint']), {
+                'kind': e['kind'], 'endpoint': e['endpoint'], 'requests': 0, 'hits': 0, 'errors': 0,
+                'bytes': 0, 'net': 0.0, 'wait': 0.0, 'disk': 0.0, 'durations': [],
+            })
+            row['bytes'] += e['bytes']
+            row['net'] += e['latency']
+            row['wait'] += e['wait']
+            row['disk'] += e['disk']
+            if e['cache'] == 'hit':
+                row['hits'] += 1
+                continue
+            row['requests'] += 1
+            row['durations'].append(e['latency'] + e['disk'])
+            if e['status'] and e['status'] >= 400: row['errors'] += 1
+        for row in rows.values():
+            durations = row.pop('durations')
+            row['p50'] = percentile(durations, 0.5)
+            row['p95'] = percentile(durations, 0.95)
+        return sorted(rows.values(), key=lambda r: r['net'] + r['wait'] + r['disk'], reverse=True)
+
+    def report(self) -> str:
+        lines = [f'{"endpoint":<28} {"reqs":>5} {"hits":>5} {"errs":>5} {"p50 ms":>8} {"p95 ms":>8} {"net s":>7} {"wait s":>7} {"disk s":>7} {"MiB":>8}']
+        for r in self.summary():
+            name = r['endpoint'] if r['kind'] == 'api' else f"{r['kind']}: {r['endpoint']}"
+            lines.append(f"{name[:28]:<28} {r['requests']:>5} {r['hits']:>5} {r['errors']:>5} {r['p50'] * 1000:>8.1f} {r['p95'] * 1000:>8.1f} "
+                         f"{r['net']:>7.2f} {r['wait']:>7.2f} {r['disk']:>7.2f} {r['bytes'] / 1024 / 1024:>8.2f}")
+        for name, n in sorted(self.counters.items()):
+            lines.append(f'{name}: {n}')
+        return '\n'.join(lines)
@@ -0,0 +1,62 @@
+import asyncio, logging, os, shutil
+from pathlib import Path
+from emthree.scanner import HashIndex, scan_mods, compare
+from emthree.mod import Mod
+from emthree.policy import VersionPolicy
+from emthree.utils import get_mod, ask_pending
+from emthree.store import JarStore
+from emthree.versions import Version
+from typing import TYPE_CHECKING
+if TYPE_CHECKING: from emthree.api import ModrinthAPI
+
+logger = logging.getLogger(__name__)
+
+async def hash_installed(modlist: list[dict], mod_path: Path, index: HashIndex = None) -> dict[str, tuple[dict, Path]]:
+    # sha512 of every installed jar listed in the modlist -> (modlist entry, path)
+    jars = await asyncio.to_thread(scan_mods, mod_path, index)
+    return {jar.sha512: (entry, jar.path) for entry, jar in compare(modlist, jars).installed}
+
+async def find_updates(api: 'ModrinthAPI', modlist: list[dict], mod_path: Path, loader: str, game_version: str, policy: VersionPolicy, index: HashIndex = None, assume_yes: bool = False) -> list[tuple[dict, Path, Version]]:
+    # checks every installed jar with a single request. returns (modlist entry, installed path, new version)
+    installed = await hash_installed(modlist, mod_path, index)
+    if not installed: return []
+    latest = await api.fetch_updates(list(installed), 'sha512', [loader], [game_version])
+    updates = []
+    unstable = []
+    for digest, (entry, path) in installed.items():
+        version = latest.get(digest)
+        if not version or version.id == entry['version_id']: continue
+        if version.version_type == 'release': updates.append((entry, path, version))
+        else: unstable.append((entry, path))
+    if unstable: updates += await _choose_versions(api, unstable, loader, game_version, policy, assume_yes)
+    return updates
+
+async def _choose_versions(api: 'ModrinthAPI', unstable: list[tuple[dict, Path]], loader: str, game_version: str, policy: VersionPolicy, assume_yes: bool) -> list[tuple[dict, Path, Version]]:
+    # the newest version is an alpha or beta. the mod's version list is resolved like init and add do, so the
+    # policy can pick, ask about or refuse it, and a newer release in between is still offered
+    mods = await asyncio.gather(*[get_mod(api, entry['project_id'], game_version, False, policy=policy, loader=loader) for entry, _ in unstable])
+    pending = [m for m in mods if m and m.pending]
+    kept = set(map(id, await ask_pending(pending, policy, assume_yes))) if pending else set()
+    current = await asyncio.gather(*[api.get_version(entry['version_id']) for entry, _ in unstable])
+    updates = []
+    for (entry, path), mod, installed in zip(unstable, mods, current):
+        if not mod or (mod.pending and id(mod) not in kept): continue
+        version = mod.selected_version
+        if not version or version.id == entry['version_id']: continue
+        # versions older than the installed one, e.g. the last release before an installed beta, aren't updates
+        if installed and version.date_published <= installed.date_published: continue
+        if version.version_type != 'release': logger.info(f"{entry['name']} {version.version_number} is a {version.version_type} version.")
+        updates.append((entry, path, version))
+    return updates
+
+def swap_in(staging: Path, mod_path: Path, replacements: list[tuple[Mod, Path]], store: JarStore = None):
+    # every new jar is downloaded and verified before this runs. each one is moved into place with an
+    # atomic rename before the version it replaces is removed, so the mods folder is never missing a mod
+    for mod, old_path in replacements:
+        if not mod.path: continue
+        new_path = Path(mod_path) / mod.path.name
+        os.replace(mod.path, new_path)
+        if store: store.moved(mod.path, new_path)
+        mod.path = new_path
+        if old_path and old_path.name != new_path.name: old_path.unlink(missing_ok=True)
+    shutil.rmtree(staging, ignore_errors=True)
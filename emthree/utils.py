@@ -2,41 +2,116 @@ import argparse, json, logging, re
 from pathlib import Path
 from platformdirs import user_config_dir, user_data_dir
 from emthree.mod import Mod, VersionStatus
+from emthree.cache import ResponseCache
+from emthree.policy import VersionPolicy, PolicyError
+from emthree.scanner import HashIndex
+from emthree.store import JarStore
+from emthree.search import SearchIndex, update_index
+from typing import TYPE_CHECKING
+if TYPE_CHECKING: from emthree.api import ModrinthAPI
 
 logger = logging.getLogger(__name__)
 
 # modAPI = MODRINTH_API
 
-def load_config(prod=True):
-    if prod:
-        config_path = Path(user_config_dir()) / 'emthree'
-        if not config_path.is_dir():
-            config_path.mkdir()
-        config_file = Path(user_config_dir()) / 'emthree' / 'emthree-config.json'
-        if config_file.is_file():
-            with config_file.open('r') as f:
-                return json.load(f)
-        else:
-            # create config file
-            mod_path = input(f'Specify mod folder location: ')
-            defaults = {
-                "game" : {
-                    "game_version": "1.21.11",
-                    "mod_path": mod_path
-                },
-                "emthree" : {
-                    "list_path": Path(user_data_dir()) / 'emthree'
-                }
-            }
-            with config_file.open('w') as f:
-                json.dump(defaults, f, indent=4)
-                return defaults
-    # dev configs
+def load_config(path: Path = None):
+    if path:
+        # an explicit config, e.g. a throwaway profile or the benchmark harness
+        with Path(path).open('r') as f:
+            return json.load(f)
+    config_path = Path(user_config_dir()) / 'emthree'
+    if not config_path.is_dir():
+        config_path.mkdir(parents=True)
+    config_file = Path(user_config_dir()) / 'emthree' / 'emthree-config.json'
+    if config_file.is_file():
+        with config_file.open('r') as f:
+            return json.load(f)
     else:
-        with open('test/config.json', 'r') as config_file:
-            return json.load(config_file)
+        # create config file
+        mod_path = input(f'Specify mod folder location: ')
+        defaults = {
+            "game" : {
+                "game_version": "1.21.11",
+                "mod_path": mod_path
+            },
+            "emthree" : {
+                "list_path": str(Path(user_data_dir()) / 'emthree')
+            }
+        }
+        with config_file.open('w') as f:
+            json.dump(defaults, f, indent=4)
+            return defaults
+
+def open_cache(args) -> ResponseCache:
+    # the response cache lives next to the mod lists, so every profile shares it
+    if args.no_cache:
+        if args.offline: logger.warning('Running offline without a cache. Nothing can be loaded.')
+        return None
+    return ResponseCache(Path(user_data_dir()) / 'emthree' / 'cache.sqlite3')
+
+def open_hash_index() -> HashIndex:
+    return HashIndex(Path(user_data_dir()) / 'emthree' / 'hashes.json')
+
+def search_index_path() -> Path:
+    return Path(user_data_dir()) / 'emthree' / 'search.idx'
+
+def open_search_index(cache: ResponseCache = None) -> SearchIndex:
+    # brings the index up to date with the projects cached since it was last built. None if there is nothing to search
+    if cache: return update_index(search_index_path(), cache)
+    return SearchIndex.open(search_index_path())
+
+def did_you_mean(name: str) -> str:
+    # a hint for a mod name that doesn't exist, from the projects emthree has seen before
+    index = open_search_index()
+    if not index: return ''
+    try:
+        suggestions = index.suggest(name)
+    finally:
+        index.close()
+    return f" Did you mean {', '.join(suggestions)}?" if suggestions else ''
 
-def prompt(q: str) -> bool:
+def open_store(config: dict, args = None) -> JarStore:
+    # every profile installs from the same store, so a jar used by several of them is only kept once
+    if not config['emthree'].get('store', True) or getattr(args, 'no_store', False):
+        return None
+    return JarStore(Path(user_data_dir()) / 'emthree' / 'store')
+
+def open_session(config: dict):
+    # the HTTP session every command uses. connections to the API and the CDN are kept alive and reused, DNS
+    # answers are cached, and a connection that stops sending data times out so the request can be retried.
+    # aiohttp is only imported here and in the API client, so commands that stay offline start without it
+    import aiohttp
+    settings = config['emthree']
+    per_host = settings.get('connections_per_host', max(settings.get('api_concurrency', 16), settings.get('download_concurrency', 8)))
+    connector = aiohttp.TCPConnector(
+        limit=settings.get('connections', 2 * per_host),
+        limit_per_host=per_host,
+        ttl_dns_cache=300,
+        keepalive_timeout=60,
+    )
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=settings.get('connect_timeout', 10), sock_read=settings.get('read_timeout', 30))
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+def open_api(session, config: dict, args) -> 'ModrinthAPI':
+    # the API client every command uses, set up from the config and the command line
+    from emthree.api import ModrinthAPI
+    return ModrinthAPI(
+        session,
+        cache=open_cache(args),
+        offline=args.offline,
+        api_concurrency=config['emthree'].get('api_concurrency', 16),
+        store=open_store(config, args),
+        root=config['emthree'].get('api_root'),
+        tracer=args.tracer,
+        max_retries=config['emthree'].get('retries', 5),
+        hedge_after=config['emthree']['hedge_after_ms'] / 1000 if config['emthree'].get('hedge_after_ms') else None,
+        chunk_size=config['emthree'].get('download_chunk_kib', 256) * 1024,
+    )
+
+def prompt(q: str, assume_yes: bool = False) -> bool:
+    if assume_yes:
+        print(f'{q} (Y/n): Y')
+        return True
     while True:
         i = input(f'{q} (Y/n): ')
         if i == 'Y':
@@ -66,33 +141,53 @@ def load_userlist(list_path: Path) -> list[str]:
                 userlist = []
                 for l in f:
                     name = l.rstrip('\n')
+                    if not name.strip(): continue
                     if re.fullmatch("^[\\w!@$()`.+,\"\\-']{3,64}$", name):
                         userlist.append(name)
                     else:
-                        logger.warning(f'Keyword {name} is not allowed. Check for typos. Exiting...')
-                        return
+                        # one bad line shouldn't stop the rest of the list from loading
+                        logger.warning(f'Keyword {name} is not allowed, skipping it.{did_you_mean(name)}')
         except Exception as e:
             logger.error(e)
         return userlist
     else: logger.warning(f'{Path} does not exist.')
 
-async def get_mod(api_session, query: str, game_version: str, is_slug: bool, version_id: str = None) -> Mod:
+async def get_mod(api_session, query: str, game_version: str, is_slug: bool, version_id: str = None, policy: VersionPolicy = None, loader: str = "fabric", shared_loaders: list[str] = None) -> Mod:
     logger.info(f'fetching mod {query}')
-    mod = Mod(api_session, query, game_version, is_slug, version_id=version_id)
-    await mod.populate_data()
+    mod = Mod(api_session, query, game_version, is_slug, version_id=version_id, loader=loader, shared_loaders=shared_loaders)
+    try:
+        await mod.populate_data()
+    except LookupError:
+        hint = did_you_mean(query)
+        if hint: logger.warning(f'{query} might be a typo.{hint}')
+        return
     logger.info(f'fetched mod {query}')
-    if mod.version_status in (VersionStatus.LEGACY_NONRELEASE_ONLY, VersionStatus.LEGACY_RELEASE, VersionStatus.LEGACY_NONRELEASE_W_RELEASE):
-        logger.warning(f"{mod.slug} doesn't explicitly support {game_version}. Please check if it is maintained at https://modrinth.com/mod/{mod.slug}")
-        if not prompt("Continue with no support for specified game version?"): return
     if mod.version_status == VersionStatus.UNAVAILABLE:
-        logger.warning(f"{mod.slug} doesn't support fabric.")
+        logger.warning(f"{mod.slug} doesn't support {mod.loader}.")
         return
-    if mod.version_status in (VersionStatus.LATEST_NONRELEASE_W_RELEASE, VersionStatus.LEGACY_NONRELEASE_W_RELEASE):
-        logger.info(f"{mod.slug} has a newer {mod.version_alt['version_type']} \
-            version {mod.version_alt['version_number']} compared to release version \
-            {mod.version['version_number']}.")
-        logger.info(f"Read changelogs here and make an informed decision. https://modrinth.com/mod/{mod.slug}")
-        bleeding_edge = prompt(f"Use bleeding edge version?")
-        if bleeding_edge: await mod.use_alt(True)
-        else: await mod.use_alt(False)
+    if not await (policy or VersionPolicy()).apply(mod): return
     return mod
+
+async def ask_pending(mods: list[Mod], policy: VersionPolicy, assume_yes: bool = False) -> list[Mod]:
+    # asks about everything the version policy couldn't decide, all at once. returns the mods to keep
+    failed = [(m, q) for m in mods for q in m.pending if policy.setting(q) == 'fail']
+    if failed:
+        for m, q in failed:
+            if q == 'legacy': logger.error(f"{m.slug} doesn't support {m.game_version}")
+            else: logger.error(f"{m.slug} has a newer {m.version_alt.version_type} version than its latest release")
+        raise PolicyError(f'{len(failed)} mods need a decision the version policy does not allow')
+    logger.info(f'{len(mods)} mods need a decision:')
+    keep = []
+    for mod in sorted(mods, key=lambda m: m.slug):
+        if 'legacy' in mod.pending:
+            logger.warning(f"{mod.slug} doesn't explicitly support {mod.game_version}. Please check if it is maintained at https://modrinth.com/mod/{mod.slug}")
+            if not prompt("Continue with no support for specified game version?", assume_yes): continue
+        if 'alt' in mod.pending:
+            logger.info(f"{mod.slug} has a newer {mod.version_alt.version_type} "
+                f"version {mod.version_alt.version_number} compared to release version "
+                f"{mod.version.version_number}.")
+            logger.info(f"Read changelogs here and make an informed decision. https://modrinth.com/mod/{mod.slug}")
+            await mod.use_alt(prompt(f"Use bleeding edge version?", assume_yes))
+        mod.pending.clear()
+        keep.append(mod)
+    return keep
@@ -0,0 +1,172 @@
+import io, json, logging, os, re, zipfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# provided by the game or the loader rather than by a jar in the mods folder
+BUILTIN = {'java', 'fabricloader', 'fabric-loader', 'quilt_loader'}
+
+class ModMeta():
+    def __init__(self, mod_id: str, version: str, jar: str, bundled: bool, provides: list[str], depends: dict, breaks: dict):
+        self.id = mod_id
+        self.version = version
+        self.jar = jar # file name of the top level jar in the mods folder
+        self.bundled = bundled # shipped inside another jar
+        self.provides = provides
+        self.depends = depends
+        self.breaks = breaks
+
+def _read_meta(archive: zipfile.ZipFile, jar: str, bundled: bool, depth: int = 0) -> list[ModMeta]:
+    # only the central directory and the entries we ask for are read, the rest of the archive is never extracted
+    try:
+        data = json.loads(archive.read('fabric.mod.json').decode('utf-8'), strict=False)
+    except KeyError:
+        return []
+    found = [ModMeta(
+        data['id'], str(data.get('version', '0')), jar, bundled,
+        list(data.get('provides', [])), dict(data.get('depends', {})), dict(data.get('breaks', {}))
+    )]
+    if depth < 4:
+        for nested in data.get('jars', []):
+            # a broken bundled jar is skipped on its own, the mod that ships it is still read
+            try:
+                with zipfile.ZipFile(io.BytesIO(archive.read(nested['file']))) as inner:
+                    found += _read_meta(inner, jar, True, depth + 1)
+            except (KeyError, TypeError, ValueError, zipfile.BadZipFile) as e:
+                logger.warning(f'Could not read a jar bundled in {jar}: {e!r}')
+    return found
+
+def read_jar(path: str) -> tuple[list[ModMeta], str]:
+    # returns the mods in the jar, and why it couldn't be read if it couldn't
+    try:
+        with zipfile.ZipFile(path) as archive:
+            return _read_meta(archive, Path(path).name, False), None
+    except (zipfile.BadZipFile, ValueError, KeyError, TypeError) as e:
+        # KeyError and TypeError come from a fabric.mod.json without an id or with fields of the wrong type
+        return [], repr(e)
+
+def read_mods_folder(mod_path: Path, workers: int = None) -> tuple[list[ModMeta], list[str], dict[str, str]]:
+    # returns the metadata of every mod, bundled ones included, the jars that aren't Fabric mods and the ones that
+    # couldn't be read, with the reason
+    with os.scandir(mod_path) as it:
+        jars = sorted(e.path for e in it if e.name.endswith('.jar') and e.is_file())
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(read_jar, jars, chunksize=8))
+    metas = [m for r, _ in results for m in r]
+    not_fabric = [Path(j).name for j, (r, error) in zip(jars, results) if not r and not error]
+    unreadable = {Path(j).name: error for j, (_, error) in zip(jars, results) if error}
+    return metas, not_fabric, unreadable
+
+# version predicates, as used by fabric.mod.json
+
+def _parse_version(version: str) -> tuple[list, str]:
+    version = version.split('+', 1)[0]
+    core, _, pre = version.partition('-')
+    parts = []
+    for p in core.split('.'):
+        parts.append(int(p) if p.isdigit() else p.lower())
+    return parts, pre
+
+def _compare(a: str, b: str) -> int:
+    (pa, prea), (pb, preb) = _parse_version(a), _parse_version(b)
+    length = max(len(pa), len(pb))
+    pa += [0] * (length - len(pa))
+    pb += [0] * (length - len(pb))
+    for x, y in zip(pa, pb):
+        if x == y: continue
+        if isinstance(x, int) and isinstance(y, int): return -1 if x < y else 1
+        return -1 if str(x) < str(y) else 1
+    # a pre-release sorts before its release
+    if prea == preb: return 0
+    if not prea: return 1
+    if not preb: return -1
+    return _compare_pre(prea, preb)
+
+def _compare_pre(a: str, b: str) -> int:
+    # semver precedence: dot separated identifiers, numeric ones compared as numbers and before alphanumeric
+    # ones, so beta.9 < beta.10 < beta.x. when one list is a prefix of the other, the shorter one comes first
+    pa, pb = a.split('.'), b.split('.')
+    for x, y in zip(pa, pb):
+        if x == y: continue
+        if x.isdigit() and y.isdigit(): return -1 if int(x) < int(y) else 1
+        if x.isdigit() != y.isdigit(): return -1 if x.isdigit() else 1
+        return -1 if x < y else 1
+    return (len(pa) > len(pb)) - (len(pa) < len(pb))
+
+def _bump(version: str, index: int) -> str:
+    parts, _ = _parse_version(version)
+    parts = [p if isinstance(p, int) else 0 for p in parts] + [0] * 3
+    parts = parts[:index] + [parts[index] + 1]
+    return '.'.join(str(p) for p in parts)
+
+_PREDICATE = re.compile(r'^(>=|<=|>|<|=|~|\^)?\s*(.+)$')
+# a space between an operator and its version, as in ">= 1.20", belongs to that predicate
+_OPERATOR_SPACE = re.compile(r'(>=|<=|>|<|=|~|\^)\s+')
+
+def _matches_one(version: str, predicate: str) -> bool:
+    predicate = predicate.strip()
+    if predicate in ('', '*'): return True
+    op, target = _PREDICATE.match(predicate).groups()
+    if re.search(r'\.[xX*]$|\.[xX*]\.', target):
+        # x-range: 1.20.x matches everything starting with 1.20
+        prefix = re.split(r'\.[xX*]', target)[0]
+        fixed = len(prefix.split('.'))
+        return _compare(version, prefix) >= 0 and _compare(version, _bump(prefix, fixed - 1)) < 0
+    if op in (None, '='): return _compare(version, target) == 0
+    if op == '>=': return _compare(version, target) >= 0
+    if op == '<=': return _compare(version, target) <= 0
+    if op == '>': return _compare(version, target) > 0
+    if op == '<': return _compare(version, target) < 0
+    if op == '~': return _compare(version, target) >= 0 and _compare(version, _bump(target, 1)) < 0
+    # ^: same major version, or same minor version for 0.x
+    parts, _ = _parse_version(target)
+    index = 1 if parts and parts[0] == 0 else 0
+    return _compare(version, target) >= 0 and _compare(version, _bump(target, index)) < 0
+
+def matches(version: str, requirement) -> bool:
+    # a list of predicates matches if any of them does, a string of space separated predicates if all of them do
+    if isinstance(requirement, list):
+        return any(matches(version, r) for r in requirement) if requirement else True
+    try:
+        return all(_matches_one(version, p) for p in _OPERATOR_SPACE.sub(r'\1', str(requirement)).split())
+    except (ValueError, AttributeError, IndexError):
+        return version == requirement
+
+def _describe(requirement) -> str:
+    if isinstance(requirement, list): return ' or '.join(str(r) for r in requirement)
+    return str(requirement)
+
+def validate(metas: list[ModMeta], game_version: str = None) -> list[str]:
+    # builds the provides/depends/breaks graph and returns every problem found in it
+    problems = []
+    provided: dict[str, list[ModMeta]] = {}
+    for m in metas:
+        for mod_id in [m.id] + m.provides:
+            provided.setdefault(mod_id, []).append(m)
+    for mod_id, providers in provided.items():
+        top_level = sorted({p.jar for p in providers if not p.bundled and p.id == mod_id})
+        if len(top_level) > 1:
+            problems.append(f'{mod_id} is installed more than once: {", ".join(top_level)}')
+
+    def versions_of(mod_id: str) -> list[str]:
+        if mod_id == 'minecraft': return [game_version] if game_version else None
+        if mod_id in BUILTIN: return None
+        return [p.version for p in provided.get(mod_id, [])]
+
+    for m in metas:
+        for dep, requirement in m.depends.items():
+            versions = versions_of(dep)
+            if versions is None: continue
+            if not versions:
+                problems.append(f'{m.id} ({m.jar}) requires {dep} {_describe(requirement)}, which is not installed')
+            elif not any(matches(v, requirement) for v in versions):
+                problems.append(f'{m.id} ({m.jar}) requires {dep} {_describe(requirement)}, but {", ".join(versions)} is installed')
+        for other, requirement in m.breaks.items():
+            versions = versions_of(other)
+            if not versions: continue
+            for v in versions:
+                if matches(v, requirement):
+                    problems.append(f'{m.id} ({m.jar}) is incompatible with {other} {v}')
+                    break
+    return problems
@@ -0,0 +1,113 @@
+class VersionStatus:
+    LATEST_RELEASE = 10 # latest mod version is release, and is for the target game version
+    LATEST_NONRELEASE_W_RELEASE = 11 # newer alpha/beta is available for the target game verison as well as a (likely) more stable release
+    LATEST_NONRELEASE_ONLY = 12 # latest mod version is alpha/beta for the target game version
+    LEGACY_RELEASE = 20 # latest mod version is release, but isn't for the target game version
+    LEGACY_NONRELEASE_W_RELEASE = 21 # newer alpha/beta is available as well as a (likely) more stable release, but not for the target game version
+    LEGACY_NONRELEASE_ONLY = 22 # latest mod version is alpha/beta, but isn't for the target game version
+    UNAVAILABLE = 30 # no versions available for your mod loader
+    MANUAL = 40 # version id manually set
+
+class ModFile():
+    # the parts of a version's file entry emthree uses
+    __slots__ = ('filename', 'url', 'size', 'sha1', 'sha512')
+
+    def __init__(self, filename: str, url: str, size: int, sha1: str = None, sha512: str = None):
+        self.filename = filename
+        self.url = url
+        self.size = size
+        self.sha1 = sha1
+        self.sha512 = sha512
+
+    @classmethod
+    def from_json(cls, f: dict) -> 'ModFile':
+        hashes = f.get('hashes') or {}
+        return cls(f['filename'], f['url'], f.get('size') or 0, hashes.get('sha1'), hashes.get('sha512'))
+
+    @property
+    def hashes(self) -> dict:
+        return {alg: h for alg, h in (('sha1', self.sha1), ('sha512', self.sha512)) if h}
+
+    def to_json(self) -> dict:
+        return {'filename': self.filename, 'url': self.url, 'size': self.size, 'hashes': self.hashes}
+
+class Version():
+    # a trimmed version object. changelogs, download counts and every file but the primary one are dropped
+    # while parsing, so a large pack's version histories don't have to stay in memory
+    __slots__ = ('id', 'project_id', 'name', 'version_number', 'version_type', 'date_published', 'loaders', 'game_versions', 'file', 'dependencies')
+
+    def __init__(self, id: str, project_id: str, name: str, version_number: str, version_type: str, date_published: str,
+                 loaders: tuple[str], game_versions: tuple[str], file: ModFile, dependencies: tuple[tuple[str, str]]):
+        self.id = id
+        self.project_id = project_id
+        self.name = name
+        self.version_number = version_number
+        self.version_type = version_type
+        self.date_published = date_published
+        self.loaders = loaders
+        self.game_versions = game_versions
+        self.file = file # the primary file, or the first one if none is marked primary
+        self.dependencies = dependencies # (project_id, version_id) of every required dependency
+
+    @classmethod
+    def from_json(cls, v: dict) -> 'Version':
+        # accepts both API version objects and the trimmed form written by to_json
+        files = v.get('files') or []
+        primary = next((f for f in files if f.get('primary')), files[0] if files else None)
+        return cls(
+            v['id'], v['project_id'], v['name'], v['version_number'], v['version_type'], v['date_published'],
+            tuple(v['loaders']), tuple(v['game_versions']),
+            ModFile.from_json(primary) if primary else None,
+            tuple((d.get('project_id'), d.get('version_id')) for d in v['dependencies'] if d['dependency_type'] == 'required'),
+        )
+
+    def to_json(self) -> dict:
+        # same shape as the API's version object, with only the fields above
+        return {
+            'id': self.id, 'project_id': self.project_id, 'name': self.name, 'version_number': self.version_number,
+            'version_type': self.version_type, 'date_published': self.date_published,
+            'loaders': list(self.loaders), 'game_versions': list(self.game_versions),
+            'files': [dict(self.file.to_json(), primary=True)] if self.file else [],
+            'dependencies': [{'project_id': p, 'version_id': v, 'dependency_type': 'required'} for p, v in self.dependencies],
+        }
+
+class VersionIndex():
+    # built once from a project's version list. for every (loader, game version) pair, and for every loader
+    # across all game versions, it keeps only the latest release and the latest alpha/beta, so each
+    # status case is answered with a dict lookup instead of scanning the whole history
+    RELEASE = 0
+    NONRELEASE = 1
+
+    def __init__(self, versions: list[Version]):
+        # (loader, game_version or None) -> [(rank, version) of latest release, (rank, version) of latest alpha/beta]
+        # rank is the position in the list sorted newest first, so a lower rank is a newer version
+        self._latest: dict[tuple, list] = {}
+        ordered = sorted(versions, key=lambda v: v.date_published, reverse=True)
+        for rank, v in enumerate(ordered):
+            kind = self.RELEASE if v.version_type == 'release' else self.NONRELEASE
+            for loader in v.loaders:
+                for key in [(loader, None)] + [(loader, gv) for gv in v.game_versions]:
+                    slots = self._latest.setdefault(key, [None, None])
+                    if slots[kind] is None: slots[kind] = (rank, v)
+
+    def select(self, loader: str, game_version: str) -> tuple[int, Version, Version]:
+        # returns (status, version, alternative version)
+        slots = self._latest.get((loader, game_version))
+        legacy = slots is None
+        if legacy:
+            slots = self._latest.get((loader, None))
+            if slots is None: return VersionStatus.UNAVAILABLE, None, None
+        release, nonrelease = slots
+        if not nonrelease:
+            status = VersionStatus.LEGACY_RELEASE if legacy else VersionStatus.LATEST_RELEASE
+            return status, release[1], None
+        if not release:
+            status = VersionStatus.LEGACY_NONRELEASE_ONLY if legacy else VersionStatus.LATEST_NONRELEASE_ONLY
+            return status, nonrelease[1], None
+        if release[0] < nonrelease[0]:
+            # the latest version is "release"
+            status = VersionStatus.LEGACY_RELEASE if legacy else VersionStatus.LATEST_RELEASE
+            return status, release[1], None
+        # a newer alpha/beta exists alongside a release. user must pick
+        status = VersionStatus.LEGACY_NONRELEASE_W_RELEASE if legacy else VersionStatus.LATEST_NONRELEASE_W_RELEASE
+        return status, release[1], nonrelease[1]